@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import yaml
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+from benchmarks.fake_upsd import fake_upsd_servers, BASE_VARIABLES
+
+
+SCENARIOS = ("fetch", "parse", "alert", "formula", "cycle")
+
+BENCH_CONFIG = {
+    "check_interval": 15,
+    "alert_mode": "basic",
+    "basic_alerts": {
+        "battery_charge": {"enabled": True, "min": 90, "message": "battery charge low"},
+        "runtime": {"enabled": True, "min": 15, "message": "runtime low"},
+        "load": {"enabled": True, "max": 50, "message": "load high"},
+        "input_voltage": {"enabled": True, "min": 110, "max": 130, "message": "voltage out of range"},
+        "ups_status": {"enabled": True, "acceptable": ["ol"], "message": "status not ok"},
+        "time_to_empty": {"enabled": True, "min": 10, "message": "battery running out"},
+    },
+    "formula_alert": {
+        "expression": "(battery_charge < 90 or actual_runtime_minutes < 20) and ups_load > 20",
+        "message": "load {ups_load}%, charge {battery_charge}%",
+    },
+    "notifications": {"enabled": False},
+    "storage": {"enabled": False},
+}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Measurement:
+    def __init__(self, name: str, trace_memory: bool):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.latencies: list[float] = []
+        self.errors = 0
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = time.perf_counter() - self.wall_start
+        self.cpu = time.process_time() - self.cpu_start
+        self.traced_peak = None
+        if self.trace_memory:
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def result(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "scenario": self.name,
+            "ops": len(latencies),
+            "errors": self.errors,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+            "ops_per_second": len(latencies) / self.wall if self.wall else 0.0,
+            "cpu_percent": self.cpu * 100 / self.wall if self.wall else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+            "traced_peak_mb": None if self.traced_peak is None else self.traced_peak / (1024 * 1024),
+        }
+
+
+def run_sync(measurement: Measurement, iterations: int, warmup: int, operation) -> dict:
+    for _ in range(warmup):
+        operation()
+    with measurement:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            if not operation():
+                measurement.errors += 1
+            measurement.latencies.append(time.perf_counter() - start)
+    return measurement.result()
+
+
+def bench_fetch(args, fakes) -> dict:
+    from nutalert.fetcher import fetch_nut_data
+
+    port = fakes[0].port
+    return run_sync(
+        Measurement("fetch", args.tracemalloc),
+        args.iterations,
+        args.warmup,
+        lambda: fetch_nut_data("127.0.0.1", port, args.timeout, "ups0"),
+    )
+
+
+def bench_parse(args, raw: str) -> dict:
+    from nutalert.parser import parse_nut_data
+
+    return run_sync(Measurement("parse", args.tracemalloc), args.iterations, args.warmup, lambda: parse_nut_data(raw))
+
+
+def bench_alert(args, name: str, nut_values, config) -> dict:
+    from nutalert.alert import should_alert
+
+    # should_alert returns (is_alerting, message), count every call as a success
+    return run_sync(
+        Measurement(name, args.tracemalloc),
+        args.iterations,
+        args.warmup,
+        lambda: should_alert(nut_values, config) or True,
+    )
+
+
+def bench_cycle(args, fakes) -> dict:
+    from nutalert.processor import get_ups_data_and_alerts
+    from nutalert.scheduler import poll_scheduler
+    from nutalert.fetcher import async_connection_pool
+
+    config = {
+        **BENCH_CONFIG,
+        "nut_servers": [{"host": "127.0.0.1", "port": fake.port, "timeout": args.timeout} for fake in fakes],
+        "max_concurrent_polls": args.concurrency,
+    }
+    expected = len(fakes) * args.devices
+    measurement = Measurement("cycle", args.tracemalloc)
+
+    async def cycle() -> bool:
+        # every server is due on every cycle, the adaptive schedule would otherwise spread them out
+        poll_scheduler.deadlines.clear()
+        snapshots = await get_ups_data_and_alerts()
+        return sum(1 for snapshot in snapshots.values() if snapshot["nut_values"] and not snapshot["stale"]) == expected
+
+    async def run() -> None:
+        for _ in range(args.warmup):
+            await cycle()
+        with measurement:
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                if not await cycle():
+                    measurement.errors += 1
+                measurement.latencies.append(time.perf_counter() - start)
+        await async_connection_pool.close_all()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "config.yaml")
+        with open(path, "w") as f:
+            yaml.safe_dump(config, f)
+        os.environ["CONFIG_PATH"] = path
+        asyncio.run(run())
+    return measurement.result()
+
+
+def print_table(results: list[dict]) -> None:
+    header = f"{'scenario':<10}{'ops':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'ops/s':>11}"
+    header += f"{'cpu %':>8}{'rss mb':>9}{'traced mb':>11}"
+    print(header)
+    for result in results:
+        traced = "-" if result["traced_peak_mb"] is None else f"{result['traced_peak_mb']:.2f}"
+        print(
+            f"{result['scenario']:<10}{result['ops']:>8}{result['errors']:>8}{result['p50_ms']:>10.3f}"
+            f"{result['p99_ms']:>10.3f}{result['max_ms']:>10.3f}{result['ops_per_second']:>11.1f}"
+            f"{result['cpu_percent']:>8.1f}{result['peak_rss_mb']:>9.1f}{traced:>11}"
+        )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="nutalert throughput and latency")
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--servers", type=int, default=1, help="fake upsd instances (default: 1)")
+    parser.add_argument("--devices", type=int, default=1, help="ups devices per server (default: 1)")
+    parser.add_argument("--variables", type=int, default=len(BASE_VARIABLES), help="variables per device")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds each fake upsd reply is held back")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of replies that fail (0-1)")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=2.0, help="nut client timeout in seconds")
+    parser.add_argument("--concurrency", type=int, default=16, help="max_concurrent_polls for the cycle scenario")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the failure injection")
+    parser.add_argument("--tracemalloc", action="store_true", help="report the traced peak per scenario (slower)")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--verbose", action="store_true", help="keep the nutalert info logs")
+    args = parser.parse_args(argv)
+    unknown = [scenario for scenario in args.scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    from nutalert.fetcher import fetch_nut_data, connection_pool
+    from nutalert.parser import parse_nut_data
+    from nutalert.utils import freeze_config
+
+    results = []
+    with fake_upsd_servers(
+        args.servers, args.devices, args.variables, args.delay, args.failure_rate, args.seed
+    ) as fakes:
+        # the parse and alert scenarios work on one clean reply, captured before any failure is injected
+        fakes[0].failure_rate = 0.0
+        raw = fetch_nut_data("127.0.0.1", fakes[0].port, args.timeout, "ups0")
+        fakes[0].failure_rate = args.failure_rate
+        nut_values = parse_nut_data(raw)
+
+        for scenario in args.scenarios:
+            if scenario == "fetch":
+                results.append(bench_fetch(args, fakes))
+            elif scenario == "parse":
+                results.append(bench_parse(args, raw))
+            elif scenario == "alert":
+                results.append(bench_alert(args, "alert", nut_values, freeze_config(BENCH_CONFIG)))
+            elif scenario == "formula":
+                config = freeze_config({**BENCH_CONFIG, "alert_mode": "formula"})
+                results.append(bench_alert(args, "formula", nut_values, config))
+            elif scenario == "cycle":
+                results.append(bench_cycle(args, fakes))
+        connection_pool.close_all()
+        requests = sum(fake.requests for fake in fakes)
+        failures = sum(fake.failures for fake in fakes)
+
+    if args.json:
+        print(json.dumps({"results": results, "upsd_requests": requests, "upsd_failures": failures}, indent=2))
+        return
+    print_table(results)
+    print(f"\nfake upsd answered {requests} request(s), {failures} injected failure(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import random
+import asyncio
+import threading
+
+from contextlib import contextmanager
+
+from nutalert.upsd import NutProtocolServer
+
+
+BASE_VARIABLES = {
+    "battery.charge": 100,
+    "battery.charge.low": 10,
+    "battery.runtime": 1800,
+    "battery.voltage": 13.5,
+    "battery.type": "PbAc",
+    "device.mfr": "nutalert",
+    "device.model": "Fake-UPS 1500",
+    "input.voltage": 121.0,
+    "output.voltage": 120.0,
+    "ups.load": 23,
+    "ups.status": "OL",
+}
+
+
+class SyntheticSource:
+    def __init__(self, devices: int = 1, variables: int = len(BASE_VARIABLES), prefix: str = "ups"):
+        filler = {f"ups.test.value{index}": index for index in range(max(0, variables - len(BASE_VARIABLES)))}
+        template = dict(list({**BASE_VARIABLES, **filler}.items())[:variables])
+        self.devices = {f"{prefix}{index}": dict(template) for index in range(devices)}
+
+    def ups_list(self) -> dict[str, str]:
+        return {name: "fake ups" for name in self.devices}
+
+    def ups_vars(self, name: str):
+        return self.devices.get(name)
+
+
+class FakeUpsd(NutProtocolServer):
+    def __init__(self, source, delay: float = 0.0, failure_rate: float = 0.0, seed: int | None = None, **kwargs):
+        super().__init__(source, **kwargs)
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+
+    async def reply(self, words: list[str]) -> bytes | None:
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.failures += 1
+            # half of the failures are protocol errors, the other half drop the connection
+            return b"ERR DATA-STALE\n" if self.random.random() < 0.5 else None
+        return await super().reply(words)
+
+
+class ServerThread:
+    # the servers get their own event loop thread so blocking clients like fetch_nut_data can reach them
+    def __init__(self, servers: list[NutProtocolServer]):
+        self.servers = servers
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="fake-upsd", daemon=True)
+
+    def start(self) -> list[int]:
+        self.thread.start()
+        return [self.call(server.start()) for server in self.servers]
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self) -> None:
+        for server in self.servers:
+            self.call(server.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@contextmanager
+def fake_upsd_servers(
+    servers: int = 1,
+    devices: int = 1,
+    variables: int = len(BASE_VARIABLES),
+    delay: float = 0.0,
+    failure_rate: float = 0.0,
+    seed: int | None = None,
+):
+    fakes = [
+        FakeUpsd(SyntheticSource(devices, variables), delay, failure_rate, seed=seed, port=0) for _ in range(servers)
+    ]
+    thread = ServerThread(fakes)
+    thread.start()
+    try:
+        yield fakes
+    finally:
+        thread.stop()
@@ -1,9 +1,90 @@
+import ast
+import math
+import string
+import operator
+
+from array import array
+from types import MappingProxyType
+from functools import lru_cache
+from itertools import compress, repeat
+
 from nutalert.utils import setup_logger
+from nutalert.tracing import traced
+from nutalert.forecast import TIME_TO_EMPTY_VARIABLE, CHARGE_RATE_VARIABLE, FORECAST_INPUT_VARIABLES, FORECAST_VARIABLES
 
 
 logger = setup_logger(__name__)
 
 
+ENV_NUT_VARIABLES = {
+    "ups_load": "ups.load",
+    "battery_charge": "battery.charge",
+    "battery_runtime": "battery.runtime",
+    "actual_runtime_minutes": "battery.runtime",
+    "battery_voltage": "battery.voltage",
+    "input_voltage": "input.voltage",
+    "ups_status": "ups.status",
+    "time_to_empty_minutes": TIME_TO_EMPTY_VARIABLE,
+    "charge_rate": CHARGE_RATE_VARIABLE,
+}
+
+BASIC_ALERT_NUT_VARIABLES = {
+    "battery_charge": "battery.charge",
+    "runtime": "battery.runtime",
+    "load": "ups.load",
+    "input_voltage": "input.voltage",
+    "ups_status": "ups.status",
+    # the forecast is derived from the charge and runtime trend, not fetched
+    "time_to_empty": "battery.charge",
+    "charge_rate": "battery.charge",
+}
+
+# always needed for the "UPS Ok" status message
+STATUS_NUT_VARIABLES = {"ups.load", "battery.charge", "battery.runtime"} | FORECAST_INPUT_VARIABLES
+
+FORMULA_NODES = (
+    ast.Expression,
+    ast.BoolOp,
+    ast.And,
+    ast.Or,
+    ast.UnaryOp,
+    ast.Not,
+    ast.USub,
+    ast.UAdd,
+    ast.BinOp,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.Compare,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+    ast.In,
+    ast.NotIn,
+    ast.IfExp,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.Tuple,
+    ast.List,
+    ast.Attribute,
+    ast.Call,
+)
+
+# the only calls a formula can make, all of them on ups_status and none able to build a large string
+FORMULA_METHODS = frozenset({"lower", "upper", "startswith", "endswith"})
+FORMULA_MAX_EXPONENT = 100
+
+FORMULA_GLOBALS = {"__builtins__": {}}
+
+
 def prepare_ups_env(nut_values):
     ups_load = float(nut_values.get("ups.load", 0))
     battery_charge = float(nut_values.get("battery.charge", 0))
@@ -12,6 +93,8 @@ def prepare_ups_env(nut_values):
     battery_voltage = float(nut_values.get("battery.voltage", 0))
     input_voltage = float(nut_values.get("input.voltage", 0))
     ups_status = nut_values.get("ups.status", "").lower()
+    time_to_empty_minutes = float(nut_values.get(TIME_TO_EMPTY_VARIABLE, math.inf))
+    charge_rate = float(nut_values.get(CHARGE_RATE_VARIABLE, 0))
 
     return {
         "ups_load": ups_load,
@@ -21,200 +104,449 @@ def prepare_ups_env(nut_values):
         "battery_voltage": battery_voltage,
         "input_voltage": input_voltage,
         "ups_status": ups_status,
+        "time_to_empty_minutes": time_to_empty_minutes,
+        "charge_rate": charge_rate,
     }
 
 
-def check_battery_charge(basic_alerts, env):
-    if "min" not in basic_alerts["battery_charge"]:
-        logger.error("missing required config: basic_alerts.battery_charge.min")
-        return "config error: battery_charge.min not specified"
-
-    min_charge = basic_alerts["battery_charge"]["min"]
-    if env["battery_charge"] < min_charge:
-        return basic_alerts["battery_charge"]["message"]
-    return None
-
-
-def check_runtime(basic_alerts, env):
-    if "min" not in basic_alerts["runtime"]:
-        logger.error("missing required config: basic_alerts.runtime.min")
-        return "config error: runtime.min not specified"
-
-    min_runtime = basic_alerts["runtime"]["min"]
-
-    if env["actual_runtime_minutes"] < min_runtime:
-        message = basic_alerts["runtime"]["message"]
-        return f"{message} ({env['actual_runtime_minutes']:.1f}min < {min_runtime}min)"
-    return None
-
-
-def check_load(basic_alerts, env):
-    if "max" not in basic_alerts["load"]:
-        logger.error("missing required config: basic_alerts.load.max")
-        return "config error: load.max not specified"
-
-    max_load = basic_alerts["load"]["max"]
-
-    if env["ups_load"] > max_load:
-        message = basic_alerts["load"]["message"]
-        return f"{message} ({env['ups_load']:.1f}% > {max_load}%)"
-    return None
-
-
-def check_input_voltage(basic_alerts, env):
-    if env["input_voltage"] <= 0:
-        return None
-
-    if "min" not in basic_alerts["input_voltage"] or "max" not in basic_alerts["input_voltage"]:
-        logger.error("missing required config: basic_alerts.input_voltage.min or max")
-        return "config error: voltage min/max not specified"
-
-    min_voltage = basic_alerts["input_voltage"]["min"]
-    max_voltage = basic_alerts["input_voltage"]["max"]
-
-    if env["input_voltage"] < min_voltage or env["input_voltage"] > max_voltage:
-        message = basic_alerts["input_voltage"]["message"]
-        return f"{message} ({env['input_voltage']:.1f}v)"
-    return None
-
-
-def check_ups_status(basic_alerts, env):
-    if not env["ups_status"]:
-        return None
-
-    if "acceptable" not in basic_alerts["ups_status"]:
-        logger.error("missing required config: basic_alerts.ups_status.acceptable")
-        return "config error: acceptable ups statuses not defined"
-
-    acceptable_statuses = basic_alerts["ups_status"]["acceptable"]
-    if env["ups_status"] not in acceptable_statuses:
-        message = basic_alerts["ups_status"]["message"]
-        if _should_skip_due_to_unchanged_status(basic_alerts, env["ups_status"]):
-            return None
-        return f"{message} ({env['ups_status']})"
-    return None
-
-
-previous_ups_status: str = ""
-
-
-def _should_skip_due_to_unchanged_status(basic_alerts, current_status: str) -> bool:
-    global previous_ups_status
-    if not _is_enabled_alert_when_status_changed(basic_alerts):
-        return False
-
-    logger.info("'alert_when_status_changed' is true")
-    if current_status == previous_ups_status:
-        logger.info(f"ups status unchanged: {current_status} (no alert)")
+def get_ok_message(env):
+    return (
+        f"UPS Ok: {env['actual_runtime_minutes']:.1f} min runtime, {env['ups_load']}% load,"
+        f" {env['battery_charge']}% charge"
+    )
+
+
+class CompiledFormula:
+    def __init__(self, expression: str, message: str, code=None, names=frozenset(), error: str | None = None):
+        self.expression = expression
+        self.message = message
+        self.code = code
+        self.names = names
+        self.error = error
+
+
+def _check_formula_tree(tree: ast.AST) -> None:
+    methods = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, FORMULA_NODES):
+            raise ValueError(f"'{type(node).__name__}' is not allowed in formula expressions")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Attribute) or node.func.attr not in FORMULA_METHODS or node.keywords:
+                allowed = ", ".join(sorted(FORMULA_METHODS))
+                raise ValueError(f"only calls to {allowed} are allowed in formula expressions")
+            methods.add(id(node.func))
+        if isinstance(node, ast.BinOp):
+            _check_formula_operation(node)
+    # attributes are only reachable as the method of an allowed call, never read on their own
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and id(node) not in methods:
+            raise ValueError(f"attribute '{node.attr}' is not allowed in formula expressions")
+
+
+def _is_number(node: ast.AST) -> bool:
+    # only values that can never be a string, anything else may repeat or %-format text
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float))
+    if isinstance(node, ast.Name):
+        return node.id != "ups_status"
+    if isinstance(node, ast.Compare):
         return True
-
-    previous_ups_status = current_status
+    if isinstance(node, ast.UnaryOp):
+        return _is_number(node.operand)
+    if isinstance(node, ast.BinOp):
+        return _is_number(node.left) and _is_number(node.right)
+    if isinstance(node, ast.BoolOp):
+        return all(_is_number(value) for value in node.values)
+    if isinstance(node, ast.IfExp):
+        return _is_number(node.body) and _is_number(node.orelse)
     return False
 
 
-def _is_enabled_alert_when_status_changed(basic_alerts) -> bool:
-    return basic_alerts["ups_status"].get("alert_when_status_changed", False)
-
-
-def check_basic_alerts(config, env):
-    if "basic_alerts" not in config:
-        logger.error("missing required config: basic_alerts")
-        return ["config error: basic_alerts not specified"]
-
-    basic_alerts = config["basic_alerts"]
-    alerts_triggered = []
-
-    if "battery_charge" in basic_alerts and basic_alerts["battery_charge"].get("enabled"):
-        alert = check_battery_charge(basic_alerts, env)
-        if alert:
-            alerts_triggered.append(alert)
-
-    if "runtime" in basic_alerts and basic_alerts["runtime"].get("enabled"):
-        alert = check_runtime(basic_alerts, env)
-        if alert:
-            alerts_triggered.append(alert)
-
-    if "load" in basic_alerts and basic_alerts["load"].get("enabled"):
-        alert = check_load(basic_alerts, env)
-        if alert:
-            alerts_triggered.append(alert)
-
-    if "input_voltage" in basic_alerts and basic_alerts["input_voltage"].get("enabled"):
-        alert = check_input_voltage(basic_alerts, env)
-        if alert:
-            alerts_triggered.append(alert)
+def _check_formula_operation(node: ast.BinOp) -> None:
+    # repeating or %-formatting a string and huge powers would let a formula exhaust memory or cpu
+    if isinstance(node.op, (ast.Mult, ast.Mod)) and not (_is_number(node.left) and _is_number(node.right)):
+        raise ValueError("'*' and '%' are only allowed between numbers in formula expressions")
+    if isinstance(node.op, ast.Pow):
+        exponent = node.right.operand if isinstance(node.right, ast.UnaryOp) else node.right
+        if not (
+            isinstance(exponent, ast.Constant)
+            and isinstance(exponent.value, (int, float))
+            and abs(exponent.value) <= FORMULA_MAX_EXPONENT
+        ):
+            raise ValueError(f"exponents must be numbers no larger than {FORMULA_MAX_EXPONENT} in formula expressions")
+        # a power of a power grows the number of digits multiplicatively
+        if not _is_number(node.left) or any(
+            isinstance(child, ast.BinOp) and isinstance(child.op, ast.Pow) for child in ast.walk(node.left)
+        ):
+            raise ValueError("the base of a power must be a number without another power in formula expressions")
+
+
+def _get_message_names(message: str) -> set[str]:
+    names = set()
+    for _, field, spec, _ in string.Formatter().parse(message):
+        if field is None:
+            continue
+        # plain names only, attribute and index lookups in a format string reach far beyond the env
+        if not field.isidentifier():
+            raise ValueError(f"message field '{{{field}}}' must be a plain variable name")
+        names.add(field)
+        if spec:
+            names |= _get_message_names(spec)
+    return names
+
+
+@lru_cache(maxsize=32)
+def compile_formula(expression: str, message: str) -> CompiledFormula:
+    try:
+        tree = ast.parse(expression, mode="eval")
+        _check_formula_tree(tree)
+        message_names = _get_message_names(message)
+    except SyntaxError as e:
+        return CompiledFormula(expression, message, error=f"invalid formula '{expression}': {e.msg}")
+    except ValueError as e:
+        return CompiledFormula(expression, message, error=f"invalid formula '{expression}': {e}")
+
+    expression_names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+    unknown = sorted((expression_names | message_names) - ENV_NUT_VARIABLES.keys())
+    if unknown:
+        return CompiledFormula(expression, message, error=f"unknown variable(s) in formula_alert: {', '.join(unknown)}")
+
+    code = compile(tree, "<formula_alert>", "eval")
+    return CompiledFormula(expression, message, code, frozenset(expression_names | message_names))
+
+
+def evaluate_formula(formula: CompiledFormula, envs) -> list[tuple[bool, str]]:
+    if formula.error:
+        return [(True, formula.error)] * len(envs)
+
+    results = []
+    for env in envs:
+        try:
+            if eval(formula.code, FORMULA_GLOBALS, env):
+                results.append((True, formula.message.format(**env)))
+            else:
+                results.append((False, get_ok_message(env)))
+        except Exception as e:
+            error_msg = f"error evaluating formula '{formula.expression}': {e}"
+            logger.error(error_msg)
+            results.append((True, error_msg))
+    return results
+
+
+def _get_formula_names(formula_alert) -> set[str] | None:
+    formula = compile_formula(formula_alert.get("expression", ""), formula_alert.get("message", ""))
+    if formula.error:
+        return None
+    return set(formula.names)
+
+
+def get_required_variables(config) -> set[str]:
+    required = set(STATUS_NUT_VARIABLES)
+
+    if config.get("alert_mode") == "formula":
+        names = _get_formula_names(config.get("formula_alert") or {})
+        if names is None:
+            return required | set(ENV_NUT_VARIABLES.values()) - FORECAST_VARIABLES
+        return required | {ENV_NUT_VARIABLES[name] for name in names if name in ENV_NUT_VARIABLES} - FORECAST_VARIABLES
+
+    basic_alerts = config.get("basic_alerts") or {}
+    for alert_name, variable in BASIC_ALERT_NUT_VARIABLES.items():
+        if (basic_alerts.get(alert_name) or {}).get("enabled"):
+            required.add(variable)
+    return required
+
+
+class BasicRule:
+    def __init__(self, name, metric, check, message, error=None, hold=None):
+        self.name = name
+        self.metric = metric
+        self.check = check
+        # relaxed check used while the alert is already firing, so a value hovering at the threshold does not flap
+        self.hold = hold or check
+        self.message = message
+        self.error = error
+
+    def format(self, value):
+        return self.message(value) if callable(self.message) else self.message or self.name
+
+
+def _rule_message(rule_config, name: str) -> str:
+    # message is optional in the config, an alert still has to say which rule fired
+    return rule_config.get("message") or f"{name.replace('_', ' ')} alert"
+
+
+def _missing_rule(name, metric, config_key, error):
+    logger.error(f"missing required config: basic_alerts.{config_key}")
+    return BasicRule(name, metric, None, None, error=error)
+
+
+def _compile_battery_charge(rule_config):
+    if "min" not in rule_config:
+        return _missing_rule(
+            "battery_charge", "battery_charge", "battery_charge.min", "config error: battery_charge.min not specified"
+        )
+    min_charge, band = rule_config["min"], rule_config.get("hysteresis", 0)
+    return BasicRule(
+        "battery_charge",
+        "battery_charge",
+        lambda column: map(operator.lt, column, repeat(min_charge)),
+        _rule_message(rule_config, "battery_charge"),
+        hold=(lambda column: map(operator.lt, column, repeat(min_charge + band))) if band else None,
+    )
+
+
+def _compile_runtime(rule_config):
+    if "min" not in rule_config:
+        return _missing_rule(
+            "runtime", "actual_runtime_minutes", "runtime.min", "config error: runtime.min not specified"
+        )
+    min_runtime, band = rule_config["min"], rule_config.get("hysteresis", 0)
+    message = _rule_message(rule_config, "runtime")
+    return BasicRule(
+        "runtime",
+        "actual_runtime_minutes",
+        lambda column: map(operator.lt, column, repeat(min_runtime)),
+        lambda value: f"{message} ({value:.1f}min < {min_runtime}min)",
+        hold=(lambda column: map(operator.lt, column, repeat(min_runtime + band))) if band else None,
+    )
+
+
+def _compile_load(rule_config):
+    if "max" not in rule_config:
+        return _missing_rule("load", "ups_load", "load.max", "config error: load.max not specified")
+    max_load, band = rule_config["max"], rule_config.get("hysteresis", 0)
+    message = _rule_message(rule_config, "load")
+    return BasicRule(
+        "load",
+        "ups_load",
+        lambda column: map(operator.gt, column, repeat(max_load)),
+        lambda value: f"{message} ({value:.1f}% > {max_load}%)",
+        hold=(lambda column: map(operator.gt, column, repeat(max_load - band))) if band else None,
+    )
+
+
+def _compile_input_voltage(rule_config):
+    if "min" not in rule_config or "max" not in rule_config:
+        return _missing_rule(
+            "input_voltage", "input_voltage", "input_voltage.min or max", "config error: voltage min/max not specified"
+        )
+    min_voltage, max_voltage = rule_config["min"], rule_config["max"]
+    message = _rule_message(rule_config, "input_voltage")
+    band = rule_config.get("hysteresis", 0)
+    return BasicRule(
+        "input_voltage",
+        "input_voltage",
+        # a reading of 0 means the ups does not report input voltage
+        lambda column: (0 < value and (value < min_voltage or value > max_voltage) for value in column),
+        lambda value: f"{message} ({value:.1f}v)",
+        hold=(
+            (
+                lambda column: (
+                    0 < value and (value < min_voltage + band or value > max_voltage - band) for value in column
+                )
+            )
+            if band
+            else None
+        ),
+    )
+
+
+def _compile_ups_status(rule_config):
+    if "acceptable" not in rule_config:
+        return _missing_rule(
+            "ups_status", "ups_status", "ups_status.acceptable", "config error: acceptable ups statuses not defined"
+        )
+    acceptable_statuses = frozenset(rule_config["acceptable"])
+    message = _rule_message(rule_config, "ups_status")
+    return BasicRule(
+        "ups_status",
+        "ups_status",
+        lambda column: (bool(status) and status not in acceptable_statuses for status in column),
+        lambda value: f"{message} ({value})",
+    )
+
+
+def _compile_time_to_empty(rule_config):
+    if "min" not in rule_config:
+        return _missing_rule(
+            "time_to_empty",
+            "time_to_empty_minutes",
+            "time_to_empty.min",
+            "config error: time_to_empty.min not specified",
+        )
+    min_minutes, band = rule_config["min"], rule_config.get("hysteresis", 0)
+    message = _rule_message(rule_config, "time_to_empty")
+    return BasicRule(
+        "time_to_empty",
+        "time_to_empty_minutes",
+        lambda column: map(operator.lt, column, repeat(min_minutes)),
+        lambda value: f"{message} (empty in {value:.1f}min < {min_minutes}min)",
+        hold=(lambda column: map(operator.lt, column, repeat(min_minutes + band))) if band else None,
+    )
+
+
+def _compile_charge_rate(rule_config):
+    if "min" not in rule_config:
+        return _missing_rule(
+            "charge_rate", "charge_rate", "charge_rate.min", "config error: charge_rate.min not specified"
+        )
+    min_rate, band = rule_config["min"], rule_config.get("hysteresis", 0)
+    message = _rule_message(rule_config, "charge_rate")
+    return BasicRule(
+        "charge_rate",
+        "charge_rate",
+        lambda column: map(operator.lt, column, repeat(min_rate)),
+        lambda value: f"{message} ({value:.2f}%/min < {min_rate}%/min)",
+        hold=(lambda column: map(operator.lt, column, repeat(min_rate + band))) if band else None,
+    )
+
+
+BASIC_RULE_COMPILERS = {
+    "battery_charge": _compile_battery_charge,
+    "runtime": _compile_runtime,
+    "load": _compile_load,
+    "input_voltage": _compile_input_voltage,
+    "ups_status": _compile_ups_status,
+    "time_to_empty": _compile_time_to_empty,
+    "charge_rate": _compile_charge_rate,
+}
+
+# env name -> (nut variable, divisor, default) for the numeric columns of a fleet pass
+NUMERIC_COLUMNS = {
+    "ups_load": ("ups.load", None, 0),
+    "battery_charge": ("battery.charge", None, 0),
+    "actual_runtime_minutes": ("battery.runtime", 60.0, 0),
+    "input_voltage": ("input.voltage", None, 0),
+    # without a forecast nothing is known to be draining
+    "time_to_empty_minutes": (TIME_TO_EMPTY_VARIABLE, None, math.inf),
+    "charge_rate": (CHARGE_RATE_VARIABLE, None, 0),
+}
+
+_rule_table_cache: tuple = (None, ())
+
+
+def compile_basic_alerts(basic_alerts) -> tuple[BasicRule, ...]:
+    global _rule_table_cache
+    cached_config, rules = _rule_table_cache
+    if cached_config is basic_alerts:
+        return rules
+
+    rules = tuple(
+        compiler(basic_alerts[name])
+        for name, compiler in BASIC_RULE_COMPILERS.items()
+        if name in basic_alerts and basic_alerts[name].get("enabled")
+    )
+    # only the read-only snapshots from load_config are safe to cache by identity
+    if isinstance(basic_alerts, MappingProxyType):
+        _rule_table_cache = (basic_alerts, rules)
+    return rules
+
+
+def build_columns(fleet_values, metrics) -> dict:
+    columns = {}
+    for metric in metrics:
+        if metric == "ups_status":
+            columns[metric] = [str(nut_values.get("ups.status", "")).lower() for nut_values in fleet_values]
+            continue
+        variable, divisor, default = NUMERIC_COLUMNS[metric]
+        column = [float(nut_values.get(variable, default)) for nut_values in fleet_values]
+        if divisor:
+            column = [value / divisor for value in column]
+        columns[metric] = array("d", column)
+    return columns
+
+
+def check_basic_alerts_fleet(basic_alerts, columns, count) -> list[dict[str, tuple[bool, str]]]:
+    # per device: rule name -> (breaching, message) for every rule that is breaching or inside its hysteresis band
+    results: list[dict[str, tuple[bool, str]]] = [{} for _ in range(count)]
+    for rule in compile_basic_alerts(basic_alerts):
+        if rule.error:
+            for rules in results:
+                rules[rule.name] = (True, rule.error)
+            continue
+
+        column = columns[rule.metric]
+        if rule.hold is rule.check:
+            for index in compress(range(count), rule.check(column)):
+                results[index][rule.name] = (True, rule.format(column[index]))
+        else:
+            breaching = list(rule.check(column))
+            for index in compress(range(count), rule.hold(column)):
+                results[index][rule.name] = (breaching[index], rule.format(column[index]))
+    return results
 
-    if "ups_status" in basic_alerts and basic_alerts["ups_status"].get("enabled"):
-        alert = check_ups_status(basic_alerts, env)
-        if alert:
-            alerts_triggered.append(alert)
 
-    return alerts_triggered
+def _get_ok_messages(columns, count) -> list[str]:
+    return [
+        f"UPS Ok: {columns['actual_runtime_minutes'][index]:.1f} min runtime, {columns['ups_load'][index]}% load,"
+        f" {columns['battery_charge'][index]}% charge"
+        for index in range(count)
+    ]
 
 
-def check_formula_alert(config, env):
+def check_formula_alert_fleet(config, envs):
     if "formula_alert" not in config:
         logger.error("missing required config: formula_alert")
-        return True, "configuration error - formula_alert not specified"
+        return [(True, "configuration error - formula_alert not specified")] * len(envs)
 
     formula_alert = config["formula_alert"]
 
     if "expression" not in formula_alert:
         logger.error("missing required config: formula_alert.expression")
-        return True, "configuration error - formula expression not specified"
+        return [(True, "configuration error - formula expression not specified")] * len(envs)
 
-    formula_expr = formula_alert["expression"]
+    formula = compile_formula(formula_alert["expression"], formula_alert.get("message", ""))
+    if formula.error:
+        logger.error(formula.error)
 
-    try:
-        alert_message = formula_alert["message"].format(**env)
-    except KeyError as e:
-        error_msg = f"invalid variable in formula message: {e}"
-        logger.error(error_msg)
-        return True, f"{error_msg}"
+    return evaluate_formula(formula, envs)
 
-    try:
-        result = eval(formula_expr, {"__builtins__": {}}, env)
-        if result:
-            return True, alert_message
-        else:
-            return (
-                False,
-                (
-                    f"UPS Ok: {env['actual_runtime_minutes']:.1f} min runtime, {env['ups_load']}% load,"
-                    f" {env['battery_charge']}% charge"
-                ),
-            )
-    except Exception as e:
-        error_msg = f"error evaluating formula '{formula_expr}': {e}"
-        logger.error(error_msg)
-        return True, f"{error_msg}"
 
+def _summarize(rules, ok_message) -> tuple[bool, str, dict]:
+    alerts = [message for breaching, message in rules.values() if breaching]
+    return (True, "; ".join(alerts), rules) if alerts else (False, ok_message, rules)
 
-def should_alert(nut_values, config):
-    env = prepare_ups_env(nut_values)
+
+@traced("evaluate_alerts_fleet")
+def evaluate_alerts_fleet(fleet_values, config) -> list[tuple[bool, str, dict[str, tuple[bool, str]]]]:
+    count = len(fleet_values)
 
     if "alert_mode" not in config:
         logger.error("missing required config: alert_mode")
-        return True, "configuration error - alert_mode not specified"
+        message = "configuration error - alert_mode not specified"
+        return [(True, message, {"config": (True, message)})] * count
 
     alert_mode = config["alert_mode"]
 
     if alert_mode == "basic":
-        alerts_triggered = check_basic_alerts(config, env)
-
-        if alerts_triggered:
-            return True, "" + "; ".join(alerts_triggered)
-        else:
-            return (
-                False,
-                (
-                    f"UPS Ok: {env['actual_runtime_minutes']:.1f} min runtime, {env['ups_load']}% load,"
-                    f" {env['battery_charge']}% charge"
-                ),
-            )
+        if "basic_alerts" not in config:
+            logger.error("missing required config: basic_alerts")
+            message = "config error: basic_alerts not specified"
+            return [(True, message, {"config": (True, message)})] * count
+
+        basic_alerts = config["basic_alerts"]
+        metrics = {rule.metric for rule in compile_basic_alerts(basic_alerts) if not rule.error}
+        columns = build_columns(fleet_values, metrics | {"ups_load", "battery_charge", "actual_runtime_minutes"})
+        results = check_basic_alerts_fleet(basic_alerts, columns, count)
+        ok_messages = _get_ok_messages(columns, count)
+        return [_summarize(rules, ok_message) for rules, ok_message in zip(results, ok_messages)]
 
     elif alert_mode == "formula":
-        return check_formula_alert(config, env)
+        results = check_formula_alert_fleet(config, [prepare_ups_env(nut_values) for nut_values in fleet_values])
+        return [
+            (is_alerting, message, {"formula": (True, message)} if is_alerting else {})
+            for is_alerting, message in results
+        ]
     else:
         logger.error(f"unknown alert mode '{alert_mode}'")
-        return True, f"unknown alert mode '{alert_mode}'"
+        message = f"unknown alert mode '{alert_mode}'"
+        return [(True, message, {"config": (True, message)})] * count
+
+
+def should_alert_fleet(fleet_values, config) -> list[tuple[bool, str]]:
+    return [(is_alerting, message) for is_alerting, message, _ in evaluate_alerts_fleet(fleet_values, config)]
+
+
+@traced("should_alert")
+def should_alert(nut_values, config):
+    return should_alert_fleet([nut_values], config)[0]
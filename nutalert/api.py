@@ -0,0 +1,187 @@
+import json
+import time
+import asyncio
+import hashlib
+
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import APIRouter, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from nutalert.stream import snapshot_stream, KEEPALIVE_INTERVAL
+from nutalert.scheduler import get_polling_config
+from nutalert.processor import get_nut_servers
+from nutalert.utils import setup_logger, load_config
+
+
+logger = setup_logger(__name__)
+
+
+# the poller counts as stalled once it has missed this many of its slowest polls
+STALLED_POLL_FACTOR = 3
+
+router = APIRouter(prefix="/api/v1")
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "last_modified", "modified")
+
+    def __init__(self, payload, modified: float):
+        self.body = json.dumps(payload, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.blake2b(self.body, digest_size=12).hexdigest()}"'
+        self.modified = int(modified)
+        self.last_modified = formatdate(modified, usegmt=True)
+
+    def not_modified(self, request: Request) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or self.etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return self.modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def respond(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Last-Modified": self.last_modified, "Cache-Control": "no-cache"}
+        if self.not_modified(request):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+    def __init__(self, stream):
+        self.stream = stream
+        self.seq = -1
+        self.names: dict[str, str] = {}
+        # responses are built on the first request of a poll generation and reused until the next poll
+        self.responses: dict[str, CachedResponse] = {}
+
+    def _sync(self) -> None:
+        if self.seq == self.stream.seq:
+            return
+        self.seq = self.stream.seq
+        self.responses = {}
+        # a device is found by its full id, or by its ups name when no other server has one of the same name
+        counts = Counter(device.rpartition("@")[0] for device in self.stream.devices)
+        self.names = {device: device for device in self.stream.devices}
+        for device in self.stream.devices:
+            ups = device.rpartition("@")[0]
+            if counts[ups] == 1:
+                self.names.setdefault(ups, device)
+
+    def _device_payload(self, device: str) -> dict:
+        ups, _, server = device.rpartition("@")
+        return {"device": device, "ups": ups, "server": server, **self.stream.devices[device]}
+
+    def fleet(self) -> CachedResponse:
+        self._sync()
+        response = self.responses.get("")
+        if response is None:
+            payload = {"seq": self.seq, "devices": [self._device_payload(device) for device in self.stream.devices]}
+            response = self.responses[""] = CachedResponse(payload, self.stream.published_at)
+        return response
+
+    def device(self, name: str) -> CachedResponse | None:
+        self._sync()
+        device = self.names.get(name)
+        if device is None:
+            return None
+        response = self.responses.get(device)
+        if response is None:
+            response = self.responses[device] = CachedResponse(
+                self._device_payload(device), self.stream.devices[device]["timestamp"]
+            )
+        return response
+
+
+response_cache = ResponseCache(snapshot_stream)
+
+
+@router.get("/ups")
+async def list_ups(request: Request):
+    return response_cache.fleet().respond(request)
+
+
+@router.get("/ups/{name}")
+async def get_ups(name: str, request: Request):
+    response = response_cache.device(name)
+    if response is None:
+        return JSONResponse({"detail": f"unknown ups '{name}'"}, status_code=404)
+    return response.respond(request)
+
+
+@router.get("/health")
+async def health():
+    devices = snapshot_stream.devices
+    payload = {
+        "status": "ok",
+        "seq": snapshot_stream.seq,
+        "last_poll_age": None,
+        "devices": len(devices),
+        "stale": sum(1 for state in devices.values() if state["stale"]),
+    }
+    config = load_config() or {}
+    if not get_nut_servers(config):
+        # nothing can be polled until the config is fixed, the poll counter stays where it is
+        payload["status"] = "config_error"
+        payload["detail"] = "no valid nut_server is configured"
+    elif not snapshot_stream.seq:
+        payload["status"] = "starting"
+    else:
+        polling_config = get_polling_config(config)
+        slowest = max(polling_config["interval"], polling_config["slow_interval"])
+        payload["last_poll_age"] = round(time.time() - snapshot_stream.published_at, 1)
+        if payload["last_poll_age"] > STALLED_POLL_FACTOR * slowest:
+            payload["status"] = "stalled"
+    return JSONResponse(payload, status_code=200 if payload["status"] == "ok" else 503)
+
+
+@router.get("/stream")
+async def stream_events():
+    subscriber = snapshot_stream.subscribe()
+
+    async def events():
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle connection
+                    yield b": keepalive\n\n"
+                    continue
+                yield message.sse
+        finally:
+            snapshot_stream.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def stream_websocket(websocket: WebSocket):
+    await websocket.accept()
+    subscriber = snapshot_stream.subscribe()
+
+    async def send_messages():
+        while True:
+            message = await subscriber.queue.get()
+            await websocket.send_text(message.text)
+
+    sender = asyncio.create_task(send_messages())
+    try:
+        # the stream is one way, reading only notices the client going away between polls
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        snapshot_stream.unsubscribe(subscriber)
@@ -1,15 +1,31 @@
+import time
 import yaml
 import asyncio
 
-from typing import Dict, Any, Optional, List
+from datetime import datetime
 
-from nicegui import ui, run, app
-import plotly.graph_objects as go
-from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, Any, Optional
 
-from nutalert.notifier import NutAlertNotifier
-from nutalert.processor import get_ups_data_and_alerts
-from nutalert.utils import setup_logger, load_config, save_config, get_config_path
+from nicegui import ui, app, run
+from fastapi import Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+import plotly.graph_objects as go
+from pydantic import ValidationError
+
+from nutalert.models import AppConfig
+from nutalert.notifier import NutAlertNotifier, notification_dispatcher
+from nutalert.fetcher import connection_pool, async_connection_pool
+from nutalert.history import metric_history, downsample, DEFAULT_METRICS
+from nutalert.storage import get_history_store_async, close_history_store
+from nutalert.processor import get_ups_data_and_alerts, get_nut_servers, prune_devices
+from nutalert.scheduler import poll_scheduler
+from nutalert.metrics import metrics_registry, CONTENT_TYPE
+from nutalert.tracing import tracer
+from nutalert.trace import trace_recorder
+from nutalert.proxy import nut_proxy
+from nutalert.api import router as api_router
+from nutalert.profiler import profile_cpu, profile_memory, ProfilerBusyError
+from nutalert.utils import setup_logger, load_config, save_config, get_config_path, read_config_text, get_recent_logs
 
 
 logger = setup_logger(__name__)
@@ -37,50 +53,7 @@ COLOR_THEME = {
 }
 
 
-class MinMaxAlert(BaseModel):
-    enabled: bool = False
-    min: Optional[int] = None
-    max: Optional[int] = None
-    message: Optional[str] = None
-
-
-class StatusAlert(BaseModel):
-    enabled: bool = False
-    acceptable: List[str] = []
-    message: Optional[str] = None
-    alert_when_status_changed: bool = False
-
-
-class BasicAlerts(BaseModel):
-    battery_charge: Optional[MinMaxAlert] = None
-    runtime: Optional[MinMaxAlert] = None
-    load: Optional[MinMaxAlert] = None
-    input_voltage: Optional[MinMaxAlert] = None
-    ups_status: Optional[StatusAlert] = None
-
-
-class NutServerConfig(BaseModel):
-    host: str
-    port: int = Field(gt=0, le=65535, description="Port must be between 1 and 65535")
-    timeout: int = Field(gt=0, description="Timeout must be a positive number")
-
-
-class FormulaAlert(BaseModel):
-    expression: str
-    message: str
-
-
-class AppConfig(BaseModel):
-    nut_server: NutServerConfig
-    check_interval: int = Field(ge=5, description="check_interval must be 5 seconds or greater")
-    alert_mode: str
-    basic_alerts: Optional[BasicAlerts] = None
-    formula_alert: Optional[FormulaAlert] = None
-
-
-def create_dial_gauge(
-    value: float, title: str, metric_type: str, range_min: float, range_max: float, config: Dict[str, Any]
-) -> go.Figure:
+def get_gauge_style(value: float, metric_type: str, range_min: float, range_max: float, config: Dict[str, Any]):
     bar_color = COLOR_THEME["primary"]
     basic_alerts = config.get("basic_alerts", {})
 
@@ -160,17 +133,83 @@ def create_dial_gauge(
         )
         range_max = display_max
 
+    gauge = {"axis": {"range": [range_min, range_max]}, "bar": {"color": bar_color}, "steps": steps}
+    return round(float(value), 1), gauge
+
+
+def create_dial_gauge(
+    value: float, title: str, metric_type: str, range_min: float, range_max: float, config: Dict[str, Any]
+) -> Dict[str, Any]:
+    value, gauge = get_gauge_style(value, metric_type, range_min, range_max, config)
+    # plain dict figures skip plotly's validation and can be patched in place on every poll
+    return {
+        "data": [
+            {
+                "type": "indicator",
+                "mode": "gauge+number",
+                "value": value,
+                "title": {"text": title, "font": {"size": 16}},
+                "gauge": gauge,
+            }
+        ],
+        "layout": {
+            "height": 200,
+            "margin": {"l": 30, "r": 30, "t": 50, "b": 20},
+            "paper_bgcolor": COLOR_THEME["gauge_background"],
+            "plot_bgcolor": COLOR_THEME["gauge_background"],
+            "font": {"color": COLOR_THEME["text"]},
+        },
+    }
+
+
+def update_dial_gauge(
+    plot: ui.plotly, value: float, metric_type: str, range_min: float, range_max: float, config: Dict[str, Any]
+) -> None:
+    value, gauge = get_gauge_style(value, metric_type, range_min, range_max, config)
+    indicator = plot.figure["data"][0]
+    if indicator["value"] == value and indicator["gauge"] == gauge:
+        return
+    indicator["value"] = value
+    indicator["gauge"] = gauge
+    plot.update()
+
+
+HISTORY_RANGES = {
+    "1 hour": 3600,
+    "24 hours": 86400,
+    "7 days": 7 * 86400,
+    "30 days": 30 * 86400,
+    "1 year": 365 * 86400,
+}
+HISTORY_POINTS = 500
+
+
+async def query_history(device: str, metric: str, seconds: int):
+    end = time.time()
+    start = end - seconds
+    history_store = await get_history_store_async(state.config)
+    if history_store is not None:
+        rows = await run.io_bound(history_store.query, device, metric, start, end)
+    else:
+        rows = metric_history.query(device, metric, start, end)
+    if len(rows) > HISTORY_POINTS:
+        rows = downsample(((ts, mean) for ts, _, _, mean in rows), start, end, HISTORY_POINTS)
+    return rows
+
+
+def create_history_figure(rows, metric: str) -> go.Figure:
     fig = go.Figure(
-        go.Indicator(
-            mode="gauge+number",
-            value=round(float(value), 1),
-            title={"text": title, "font": {"size": 16}},
-            gauge={"axis": {"range": [range_min, range_max]}, "bar": {"color": bar_color}, "steps": steps},
+        go.Scatter(
+            x=[datetime.fromtimestamp(ts) for ts, _, _, _ in rows],
+            y=[mean for _, _, _, mean in rows],
+            mode="lines",
+            name=metric,
+            line={"color": COLOR_THEME["primary"]},
         )
     )
     fig.update_layout(
-        height=200,
-        margin=dict(l=30, r=30, t=50, b=20),
+        height=300,
+        margin=dict(l=40, r=20, t=20, b=40),
         paper_bgcolor=COLOR_THEME["gauge_background"],
         plot_bgcolor=COLOR_THEME["gauge_background"],
         font={"color": COLOR_THEME["text"]},
@@ -180,99 +219,127 @@ def create_dial_gauge(
 
 class AppState:
     def __init__(self):
-        self.config = load_config()
-        self.config_text = yaml.dump(self.config, sort_keys=False, indent=2)
+        self.config_text = read_config_text()
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
         self.nut_values: Dict[str, Any] = {"ups.status": "INITIALIZING"}
         self.alert_message: str = "Awaiting first data poll..."
         self.is_alerting: bool = False
-        self.logs: str = "Initializing log view..."
+        # bumped whenever a poll lands, sessions skip rendering while it is unchanged
+        self.generation: int = 0
+
+    @property
+    def config(self):
+        return load_config()
 
     async def poll_ups_data(self):
         while True:
             try:
-                result = await run.io_bound(get_ups_data_and_alerts)
-                if result:
-                    nut_values, alert_message, is_alerting, new_logs = result
-                    self.nut_values = nut_values or self.nut_values
-                    self.alert_message = alert_message
-                    self.is_alerting = is_alerting
-                    self.logs = new_logs or self.logs
+                snapshots = await get_ups_data_and_alerts()
+                if snapshots:
+                    self.snapshots.update(snapshots)
+                    prune_devices(self.snapshots, get_nut_servers(self.config), snapshots)
+                    self.alert_message = ""
+                    self.is_alerting = False
+                else:
+                    self.alert_message = "configuration error"
+                    self.is_alerting = True
             except Exception as e:
                 logger.error(f"Error in background polling task: {e}")
                 self.alert_message = f"Error: {e}"
                 self.is_alerting = True
+            self.generation += 1
+
+            await asyncio.sleep(poll_scheduler.time_until_next())
 
-            await asyncio.sleep(self.config.get("check_interval", 15))
+    def get_snapshot(self, device: Optional[str]) -> Dict[str, Any]:
+        snapshot = self.snapshots.get(device) or next(iter(self.snapshots.values()), None)
+        if snapshot is None:
+            return {"nut_values": self.nut_values, "alert_message": self.alert_message, "is_alerting": self.is_alerting}
+        if self.is_alerting:
+            return {**snapshot, "alert_message": self.alert_message, "is_alerting": True}
+        return snapshot
 
     def update_ui_components(self, ui_elements: Dict[str, Any]):
+        if "log_view" in ui_elements:
+            lines, ui_elements["log_cursor"] = get_recent_logs(ui_elements.get("log_cursor", 0))
+            if lines:
+                ui_elements["log_view"].push("\n".join(lines))
+
+        device_select = ui_elements.get("device_select")
+        if device_select is not None:
+            devices = list(self.snapshots)
+            if devices != device_select.options:
+                selected = device_select.value if device_select.value in devices else None
+                device_select.set_options(devices, value=selected)
+            if device_select.visible != (len(devices) > 1):
+                device_select.set_visibility(len(devices) > 1)
+
+        config = self.config
+        selected = device_select.value if device_select is not None else None
+        rendered = (self.generation, selected, config)
+        if ui_elements.get("rendered") == rendered:
+            return
+        ui_elements["rendered"] = rendered
+
+        snapshot = self.get_snapshot(selected)
+        nut_values = snapshot["nut_values"]
+        is_alerting = snapshot["is_alerting"]
+        alert_message = snapshot["alert_message"]
+
         if "header_status_card" in ui_elements:
             header_status_card = ui_elements["header_status_card"]
             header_status_icon = ui_elements["header_status_icon"]
             header_status_label = ui_elements["header_status_label"]
 
-            if self.is_alerting:
+            if is_alerting:
                 header_status_card.classes(
                     remove=f"bg-[{COLOR_THEME['success_banner_bg']}]",
                     add=f"bg-[{COLOR_THEME['error_banner_bg']}] text-[{COLOR_THEME['text']}]",
                 )
                 header_status_icon.props("name=error")
-                header_status_label.set_text(self.alert_message)
+                header_status_label.set_text(alert_message)
             else:
                 header_status_card.classes(
                     remove=f"bg-[{COLOR_THEME['error_banner_bg']}]",
                     add=f"bg-[{COLOR_THEME['success_banner_bg']}] text-[{COLOR_THEME['text']}]",
                 )
                 header_status_icon.props("name=check_circle")
-                header_status_label.set_text(f"Status: {self.nut_values.get('ups.status', 'UNKNOWN').upper()}")
-            header_status_card.update()
-            header_status_icon.update()
-            header_status_label.update()
+                header_status_label.set_text(f"Status: {nut_values.get('ups.status', 'UNKNOWN').upper()}")
 
         if "load_plot" in ui_elements:
-            plot = ui_elements["load_plot"]
-            plot.figure = create_dial_gauge(
-                float(self.nut_values.get("ups.load", 0.0)), "UPS Load (%)", "load", 0, 100, self.config
-            )
-            plot.update()
+            update_dial_gauge(ui_elements["load_plot"], float(nut_values.get("ups.load", 0.0)), "load", 0, 100, config)
 
         if "charge_plot" in ui_elements:
-            plot = ui_elements["charge_plot"]
-            plot.figure = create_dial_gauge(
-                float(self.nut_values.get("battery.charge", 0.0)), "Battery Charge (%)", "charge", 0, 100, self.config
+            update_dial_gauge(
+                ui_elements["charge_plot"], float(nut_values.get("battery.charge", 0.0)), "charge", 0, 100, config
             )
-            plot.update()
 
         if "runtime_plot" in ui_elements:
-            plot = ui_elements["runtime_plot"]
-            plot.figure = create_dial_gauge(
-                float(self.nut_values.get("battery.runtime", 0.0)), "Runtime (min)", "runtime", 0, 0, self.config
+            update_dial_gauge(
+                ui_elements["runtime_plot"], float(nut_values.get("battery.runtime", 0.0)), "runtime", 0, 0, config
             )
-            plot.update()
 
         if "voltage_plot" in ui_elements:
-            plot = ui_elements["voltage_plot"]
-            voltage = float(self.nut_values.get("input.voltage", 0.0))
-            plot.figure = create_dial_gauge(
-                voltage, "Input Voltage (V)", "voltage", 0, 260 if voltage > 180 else 150, self.config
-            )
-            plot.update()
+            voltage = float(nut_values.get("input.voltage", 0.0))
+            update_dial_gauge(ui_elements["voltage_plot"], voltage, "voltage", 0, 260 if voltage > 180 else 150, config)
 
         if "raw_data_grid" in ui_elements:
             grid = ui_elements["raw_data_grid"]
-            grid.clear()
-            with grid:
-                if self.nut_values:
-                    sorted_items = sorted(self.nut_values.items())
-                    for key, value in sorted_items:
+            rows = ui_elements.setdefault("raw_data_rows", {})
+            if rows.keys() != nut_values.keys():
+                # the set of variables only changes on inventory polls, everything else is patched per key
+                grid.clear()
+                rows.clear()
+                with grid:
+                    for key, value in sorted(nut_values.items()):
                         with ui.row().classes("w-full items-center justify-between pr-10"):
                             ui.label(f"{key}:").classes("font-mono text-sm font-bold")
-                            ui.label(str(value)).classes("font-mono text-sm")
-
-        if "log_view" in ui_elements:
-            log_element = ui_elements["log_view"]
-            log_element.clear()
-            for line in self.logs.splitlines():
-                log_element.push(line)
+                            rows[key] = ui.label(str(value)).classes("font-mono text-sm")
+            else:
+                for key, value in nut_values.items():
+                    text = str(value)
+                    if rows[key].text != text:
+                        rows[key].set_text(text)
 
 
 state = AppState()
@@ -286,6 +353,7 @@ def build_header(ui_elements: Dict[str, Any]):
             ui.image("/assets/logo.svg").classes("w-10 h-9 mr-0 no-darkreader")
             ui.label("nutalert").classes("text-2xl font-bold")
         with ui.row().classes("items-center"):
+            ui_elements["device_select"] = ui.select([], label="UPS").classes("min-w-[12rem]").props("dense dark")
             with ui.card().classes("p-2 transition-all") as card:
                 ui_elements["header_status_card"] = card
                 with ui.row().classes("items-center no-wrap gap-x-2"):
@@ -315,6 +383,47 @@ def build_raw_data_display(ui_elements: Dict[str, Any]):
         )
 
 
+def build_history_chart(ui_elements: Dict[str, Any]):
+    metrics = list((state.config.get("history") or {}).get("metrics", DEFAULT_METRICS))
+    with ui.card().classes(f"w-full bg-[{COLOR_THEME['card']}]"):
+        with ui.row().classes("w-full justify-between items-center"):
+            ui.label("History").classes("text-lg font-semibold")
+            with ui.row().classes("items-center gap-x-4"):
+                metric_select = ui.select(metrics, value=metrics[0], label="Metric").classes("min-w-[10rem]")
+                range_select = ui.select(list(HISTORY_RANGES), value="24 hours", label="Range").classes("min-w-[8rem]")
+        plot = ui.plotly(create_history_figure([], metric_select.value)).classes("w-full")
+
+        def selected_device():
+            device_select = ui_elements.get("device_select")
+            device = device_select.value if device_select is not None else None
+            return device or next(iter(state.snapshots), None)
+
+        async def refresh():
+            device = selected_device()
+            rows = (
+                await query_history(device, metric_select.value, HISTORY_RANGES[range_select.value]) if device else []
+            )
+            plot.figure = create_history_figure(rows, metric_select.value)
+            plot.update()
+
+        async def export_csv():
+            device = selected_device()
+            history_store = await get_history_store_async(state.config)
+            if not device or history_store is None:
+                ui.notify("History storage is not enabled.", color="negative")
+                return
+            start = time.time() - HISTORY_RANGES[range_select.value]
+            data = await run.io_bound(history_store.export_csv, device, metrics, start)
+            ui.download(data.encode(), f"nutalert-{device.split('@')[0]}-history.csv", "text/csv")
+
+        metric_select.on_value_change(refresh)
+        range_select.on_value_change(refresh)
+        with ui.row().classes("w-full justify-start items-center gap-x-4"):
+            ui.button("Refresh", on_click=refresh, icon="refresh", color=COLOR_THEME["button_color"])
+            ui.button("Export CSV", on_click=export_csv, icon="download", color=COLOR_THEME["button_color"])
+        ui.timer(60, refresh)
+
+
 def build_config_editor():
     with ui.card().classes(f"w-full bg-[{COLOR_THEME['card']}]"):
         with ui.row().classes("w-full justify-between items-center"):
@@ -334,9 +443,11 @@ def build_config_editor():
             .style("height: 58vh")
         )
 
-        def send_test_notification():
+        async def send_test_notification():
             notifier = NutAlertNotifier(state.config)
-            success = notifier.notify_apprise("Test Notification", "This is a test notification from nutalert.")
+            success = await run.io_bound(
+                notifier.notify_apprise, "Test Notification", "This is a test notification from nutalert."
+            )
             if success:
                 ui.notify("Test notification sent successfully!", color="positive")
             else:
@@ -349,7 +460,6 @@ def build_config_editor():
                     new_config_data = yaml.safe_load(state.config_text)
                     AppConfig.model_validate(new_config_data)
                     save_status = save_config(new_config_data)
-                    state.config = new_config_data
                     ui.notify(save_status, color="positive" if "successfully" in save_status else "negative")
                 except ValidationError as e:
                     ui.notify(f"Configuration Error: {e}", color="negative", multi_line=True, wrap=True)
@@ -407,6 +517,7 @@ async def dashboard_page():
             with ui.tab_panel("Dashboard"):
                 with ui.column().classes("w-full gap-y-4"):
                     build_dashboard_gauges(ui_elements)
+                    build_history_chart(ui_elements)
                     build_raw_data_display(ui_elements)
 
             with ui.tab_panel("Configuration"):
@@ -415,10 +526,51 @@ async def dashboard_page():
             with ui.tab_panel("Logs"):
                 build_log_viewer(ui_elements)
 
+    ui_elements["device_select"].on_value_change(lambda: state.update_ui_components(ui_elements))
     ui.timer(interval=1, callback=lambda: state.update_ui_components(ui_elements), active=True)
 
 
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(content=metrics_registry.payload, media_type=CONTENT_TYPE)
+
+
+def admin_enabled() -> bool:
+    return bool((load_config().get("profiling") or {}).get("admin", False))
+
+
+@app.get("/admin/spans")
+def spans_endpoint(reset: bool = False):
+    if not admin_enabled():
+        return PlainTextResponse("not found", status_code=404)
+    stats = {"enabled": tracer.enabled, "spans": tracer.stats()}
+    if reset:
+        tracer.reset()
+    return JSONResponse(stats)
+
+
+@app.get("/admin/profile")
+async def profile_endpoint(mode: str = "cpu", seconds: float = 10, top: int = 20):
+    if not admin_enabled():
+        return PlainTextResponse("not found", status_code=404)
+    profilers = {"cpu": profile_cpu, "memory": profile_memory}
+    if mode not in profilers:
+        return PlainTextResponse(f"unknown profile mode '{mode}', use cpu or memory", status_code=400)
+    try:
+        return PlainTextResponse(await profilers[mode](seconds, top))
+    except ProfilerBusyError as e:
+        return PlainTextResponse(str(e), status_code=409)
+
+
+app.include_router(api_router)
+app.on_startup(nut_proxy.start)
 app.on_startup(state.poll_ups_data)
+app.on_shutdown(connection_pool.close_all)
+app.on_shutdown(async_connection_pool.close_all)
+app.on_shutdown(close_history_store)
+app.on_shutdown(trace_recorder.close)
+app.on_shutdown(nut_proxy.close)
+app.on_shutdown(notification_dispatcher.close)
 app.add_static_files("/assets", "assets")
 
 if __name__ in {"__main__", "__mp_main__"}:
@@ -1,25 +1,449 @@
+import time
 import socket
-import select
+import asyncio
+import threading
+
+from contextlib import contextmanager, asynccontextmanager
+
+from nutalert.parser import parse_ups_list
 from nutalert.utils import setup_logger
+from nutalert.metrics import metrics_registry
+from nutalert.tracing import traced
+from nutalert.trace import trace_recorder
 
 
 logger = setup_logger(__name__)
 
 
-def fetch_nut_data(host, port, timeout=2):
-    command = "list var ups\r\n"
+RECV_SIZE = 4096
+KEEPALIVE_INTERVAL = 30
+RECONNECT_BACKOFF_BASE = 1
+RECONNECT_BACKOFF_MAX = 60
+# consecutive failures before the circuit to an endpoint opens and polls stop dialing it
+FAILURE_THRESHOLD = 3
+
+
+def _find_reply_end(buffer: bytearray, end_marker: bytes | None, scan_from: int) -> int:
+    if end_marker is None or buffer.startswith(b"ERR"):
+        return buffer.find(b"\n")
+
+    marker_pos = buffer.find(end_marker, scan_from)
+    if marker_pos == -1:
+        return -1
+    return buffer.find(b"\n", marker_pos)
+
+
+def read_reply(sock, end_marker: bytes | None, timeout) -> bytes:
+    buffer = bytearray()
+    marker_len = len(end_marker) if end_marker else 0
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("timed out waiting for the end of the nut reply")
+        sock.settimeout(remaining)
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            raise ConnectionResetError("nut server closed the connection before the reply was complete")
+        # only rescan the tail, a marker can straddle two chunks
+        scan_from = max(0, len(buffer) - marker_len)
+        buffer += chunk
+        if _find_reply_end(buffer, end_marker, scan_from) != -1:
+            return bytes(buffer)
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class _CircuitBreaker:
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.last_used = 0.0
+        self.failures = 0
+        self.next_attempt = 0.0
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    @property
+    def state(self) -> str:
+        if self.failures < FAILURE_THRESHOLD:
+            return "closed"
+        return "open" if time.monotonic() < self.next_attempt else "half-open"
+
+    def _check_backoff(self) -> None:
+        # while open, calls fail right away; once the backoff passes, the next call is let through as a probe
+        now = time.monotonic()
+        if self.failures >= FAILURE_THRESHOLD and now < self.next_attempt:
+            raise CircuitOpenError(f"circuit to {self.address} is open for another {self.next_attempt - now:.0f}s")
+
+    def _record_success(self) -> None:
+        if self.failures >= FAILURE_THRESHOLD:
+            logger.info(f"circuit to {self.address} closed after {self.failures} failure(s)")
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.last_used = time.monotonic()
+        logger.info(f"opened nut session to {self.address}")
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        if self.failures < FAILURE_THRESHOLD:
+            logger.warning(f"connection to {self.address} failed {self.failures} time(s)")
+            return
+        backoff = min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** (self.failures - FAILURE_THRESHOLD))
+        self.next_attempt = time.monotonic() + backoff
+        logger.warning(f"circuit to {self.address} open after {self.failures} failure(s), next probe in {backoff}s")
+
+
+class NutConnection(_CircuitBreaker):
+    def __init__(self, host, port, timeout):
+        super().__init__(host, port, timeout)
+        self.sock: socket.socket | None = None
+        self.lock = threading.Lock()
+
+    def connect(self) -> None:
+        self._check_backoff()
+        start = time.perf_counter()
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError:
+            self._record_failure()
+            raise
+        metrics_registry.observe("connect", time.perf_counter() - start)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._record_success()
+
+    def close(self) -> None:
+        if self.sock is None:
+            return
+        try:
+            self.sock.sendall(b"LOGOUT\n")
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        finally:
+            self.sock = None
+
+    def _send(self, command: bytes, end_marker: bytes | None) -> bytes:
+        self.sock.sendall(command)
+        reply = read_reply(self.sock, end_marker, self.timeout)
+        self.last_used = time.monotonic()
+        return reply
+
+    def is_healthy(self) -> bool:
+        if self.sock is None:
+            return False
+        if time.monotonic() - self.last_used < KEEPALIVE_INTERVAL:
+            return True
+        try:
+            return not self._send(b"VER\n", None).startswith(b"ERR")
+        except OSError:
+            return False
+
+    def request(self, command: bytes, end_marker: bytes | None = None) -> bytes:
+        reused = self.is_healthy()
+        if not reused:
+            self.close()
+            self.connect()
+        try:
+            return self._send(command, end_marker)
+        except OSError:
+            self.close()
+            if not reused:
+                self._record_failure()
+                raise
+        # the pooled session went stale between polls, dial once more
+        logger.info(f"nut session to {self.address} went stale, reconnecting")
+        self.connect()
+        try:
+            return self._send(command, end_marker)
+        except OSError:
+            self.close()
+            self._record_failure()
+            raise
+
+
+class NutConnectionPool:
+    def __init__(self):
+        self._connections: dict[tuple[str, int], NutConnection] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self, host, port, timeout):
+        with self._lock:
+            connection = self._connections.get((host, port))
+            if connection is None:
+                connection = NutConnection(host, port, timeout)
+                self._connections[(host, port)] = connection
+        with connection.lock:
+            connection.timeout = timeout
+            yield connection
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            with connection.lock:
+                connection.close()
+
+
+connection_pool = NutConnectionPool()
+
+
+@traced("fetch_nut_data")
+def fetch_nut_data(host, port, timeout=2, ups_name="ups"):
+    command = f"LIST VAR {ups_name}\n".encode()
+    end_marker = b"END LIST VAR"
     raw_nut_data = ""
     try:
-        with socket.create_connection((host, port), timeout=timeout) as sock:
-            sock.sendall(command.encode())
-            while True:
-                ready, _, _ = select.select([sock], [], [], timeout)
-                if not ready:
-                    break
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                raw_nut_data += chunk.decode("utf-8", errors="replace")
+        start = time.perf_counter()
+        with connection_pool.borrow(host, port, timeout) as connection:
+            reply = connection.request(command, end_marker)
+        rtt_ms = (time.perf_counter() - start) * 1000
+        metrics_registry.observe("fetch", rtt_ms / 1000)
+        raw_nut_data = reply.decode("utf-8", errors="replace")
+        if raw_nut_data.startswith("ERR"):
+            logger.error(f"nut server returned an error: {raw_nut_data.strip()}")
+            metrics_registry.inc("nutalert_errors_total", stage="fetch")
+            return ""
+        logger.info(
+            f"nut data received in {rtt_ms:.1f}ms ({len(reply)} bytes)",
+            extra={"device": f"{ups_name}@{host}:{port}", "stage": "fetch", "duration": round(rtt_ms, 1)},
+        )
+        trace_recorder.record({f"{ups_name}@{host}:{port}": raw_nut_data}, time.time())
+    except socket.timeout:
+        logger.error(f"timed out contacting nut server at {host}:{port}")
+        metrics_registry.inc("nutalert_errors_total", stage="fetch")
     except socket.error as e:
         logger.error(f"socket error when contacting nut server: {e}")
+        metrics_registry.inc("nutalert_errors_total", stage="fetch")
     return raw_nut_data
+
+
+class AsyncNutConnection(_CircuitBreaker):
+    def __init__(self, host, port, timeout):
+        super().__init__(host, port, timeout)
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        self._check_backoff()
+        start = time.perf_counter()
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        except OSError:
+            self._record_failure()
+            raise
+        metrics_registry.observe("connect", time.perf_counter() - start)
+        self._record_success()
+
+    async def close(self) -> None:
+        if self.writer is None:
+            return
+        writer, self.reader, self.writer = self.writer, None, None
+        try:
+            writer.write(b"LOGOUT\n")
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), self.timeout)
+        except OSError:
+            pass
+
+    async def _read_replies(self, end_markers: list[bytes | None]) -> list[bytes]:
+        replies = []
+        for end_marker in end_markers:
+            lines = []
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    raise ConnectionResetError("nut server closed the connection before the reply was complete")
+                lines.append(line)
+                if end_marker is None or line.startswith(b"ERR") or line.startswith(end_marker):
+                    break
+            replies.append(b"".join(lines))
+        return replies
+
+    async def _send(self, requests: list[tuple[bytes, bytes | None]]) -> list[bytes]:
+        # pipeline every command in one write, upsd answers them in order
+        self.writer.write(b"".join(command for command, _ in requests))
+        await self.writer.drain()
+        replies = await asyncio.wait_for(self._read_replies([marker for _, marker in requests]), self.timeout)
+        self.last_used = time.monotonic()
+        return replies
+
+    async def is_healthy(self) -> bool:
+        if self.writer is None or self.writer.is_closing():
+            return False
+        if time.monotonic() - self.last_used < KEEPALIVE_INTERVAL:
+            return True
+        try:
+            (reply,) = await self._send([(b"VER\n", None)])
+            return not reply.startswith(b"ERR")
+        except OSError:
+            return False
+
+    async def request_many(self, requests: list[tuple[bytes, bytes | None]]) -> list[bytes]:
+        reused = await self.is_healthy()
+        if not reused:
+            await self.close()
+            await self.connect()
+        try:
+            return await self._send(requests)
+        except OSError:
+            await self.close()
+            if not reused:
+                self._record_failure()
+                raise
+        logger.info(f"nut session to {self.address} went stale, reconnecting")
+        await self.connect()
+        try:
+            return await self._send(requests)
+        except OSError:
+            await self.close()
+            self._record_failure()
+            raise
+
+
+class AsyncNutConnectionPool:
+    def __init__(self):
+        self._connections: dict[tuple[str, int], AsyncNutConnection] = {}
+
+    @asynccontextmanager
+    async def borrow(self, host, port, timeout):
+        connection = self._connections.get((host, port))
+        if connection is None:
+            connection = AsyncNutConnection(host, port, timeout)
+            self._connections[(host, port)] = connection
+        async with connection.lock:
+            connection.timeout = timeout
+            yield connection
+
+    async def close_all(self) -> None:
+        connections = list(self._connections.values())
+        self._connections.clear()
+        for connection in connections:
+            async with connection.lock:
+                await connection.close()
+
+
+async_connection_pool = AsyncNutConnectionPool()
+
+
+DISCOVERY_INTERVAL = 300
+
+_discovered_devices: dict[tuple[str, int], tuple[float, list[str]]] = {}
+
+
+def device_id(ups_name: str, host, port) -> str:
+    return f"{ups_name}@{host}:{port}"
+
+
+async def _get_devices(connection: AsyncNutConnection, server: dict) -> list[str]:
+    if server.get("devices"):
+        return list(server["devices"])
+
+    key = (server["host"], server["port"])
+    discovered_at, devices = _discovered_devices.get(key, (0.0, []))
+    if devices and time.monotonic() - discovered_at < DISCOVERY_INTERVAL:
+        return devices
+
+    (reply,) = await connection.request_many([(b"LIST UPS\n", b"END LIST UPS")])
+    devices = parse_ups_list(reply.decode("utf-8", errors="replace"))
+    if devices:
+        logger.info(f"discovered {len(devices)} ups device(s) on {connection.address}: {', '.join(devices)}")
+    else:
+        logger.error(f"no ups devices reported by nut server at {connection.address}")
+    _discovered_devices[key] = (time.monotonic(), devices)
+    return devices
+
+
+def _build_requests(devices: list[str], variables: list[str] | None) -> list[tuple[bytes, bytes | None]]:
+    if not variables:
+        return [(f"LIST VAR {name}\n".encode(), b"END LIST VAR") for name in devices]
+    return [(f"GET VAR {name} {variable}\n".encode(), None) for name in devices for variable in variables]
+
+
+def _join_device_replies(replies: list[bytes]) -> str:
+    # GET VAR answers use the same 'VAR <ups> <name> "<value>"' lines as LIST VAR
+    lines = []
+    for reply in replies:
+        if reply.startswith(b"ERR"):
+            if reply.startswith(b"ERR VAR-NOT-SUPPORTED"):
+                continue
+            return reply.decode("utf-8", errors="replace")
+        lines.append(reply)
+    return b"".join(lines).decode("utf-8", errors="replace")
+
+
+def _known_devices(server: dict) -> dict[str, str]:
+    host, port = server["host"], server["port"]
+    names = server.get("devices") or _discovered_devices.get((host, port), (0.0, []))[1] or [""]
+    return {device_id(name, host, port): "" for name in names}
+
+
+@traced("fetch_server")
+async def fetch_server(server: dict, variables: list[str] | None = None) -> dict[str, str]:
+    host, port, timeout = server["host"], server["port"], server["timeout"]
+    try:
+        start = time.perf_counter()
+        async with async_connection_pool.borrow(host, port, timeout) as connection:
+            devices = await _get_devices(connection, server)
+            if not devices:
+                return {device_id("", host, port): ""}
+            replies = await connection.request_many(_build_requests(devices, variables))
+        rtt_ms = (time.perf_counter() - start) * 1000
+        metrics_registry.observe("fetch", rtt_ms / 1000)
+        logger.info(
+            f"nut data for {len(devices)} device(s) received from {host}:{port} in {rtt_ms:.1f}ms"
+            f" ({sum(len(reply) for reply in replies)} bytes)",
+            extra={"device": f"{host}:{port}", "stage": "fetch", "duration": round(rtt_ms, 1)},
+        )
+    except CircuitOpenError:
+        # a dead endpoint costs nothing while its circuit is open, the processor serves the last good data
+        return _known_devices(server)
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.error(f"socket error when contacting nut server at {host}:{port}: {e}")
+        metrics_registry.inc("nutalert_errors_total", stage="fetch")
+        return _known_devices(server)
+
+    raw_by_device = {device_id(name, host, port): "" for name in devices}
+    per_device = len(variables) if variables else 1
+    for index, name in enumerate(devices):
+        raw_nut_data = _join_device_replies(replies[index * per_device : (index + 1) * per_device])
+        if raw_nut_data.startswith("ERR"):
+            logger.error(f"nut server at {host}:{port} returned an error for '{name}': {raw_nut_data.strip()}")
+            metrics_registry.inc("nutalert_errors_total", stage="fetch")
+            _discovered_devices.pop((host, port), None)
+            continue
+        raw_by_device[device_id(name, host, port)] = raw_nut_data
+    return raw_by_device
+
+
+async def fetch_fleet(
+    servers: list[dict], max_concurrency: int = 16, variables: list[str] | None = None
+) -> dict[str, str]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded_fetch(server: dict) -> dict[str, str]:
+        async with semaphore:
+            return await fetch_server(server, variables)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bounded_fetch(server) for server in servers))
+    fleet = {}
+    for raw_by_device in results:
+        fleet.update(raw_by_device)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(
+        f"polled {len(fleet)} device(s) on {len(servers)} server(s) in {elapsed_ms:.1f}ms",
+        extra={"stage": "poll", "duration": round(elapsed_ms, 1)},
+    )
+    return fleet
@@ -0,0 +1,155 @@
+import math
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+TIME_TO_EMPTY_VARIABLE = "forecast.time_to_empty_minutes"
+CHARGE_RATE_VARIABLE = "forecast.charge_rate"
+FORECAST_VARIABLES = {TIME_TO_EMPTY_VARIABLE, CHARGE_RATE_VARIABLE}
+
+# nut variables the trend engine reads on every poll
+FORECAST_INPUT_VARIABLES = {"battery.charge", "battery.runtime", "ups.load"}
+
+DEFAULT_FORECAST_CONFIG = {
+    # time constants in minutes, older samples fade out with exp(-age / window)
+    "rate_window": 5,
+    "regression_window": 10,
+    # a load step of this many percentage points makes the old slope meaningless
+    "load_step": 15,
+    # slower drains than this (%/min) are treated as flat
+    "min_drain_rate": 0.01,
+}
+
+
+def get_forecast_config(config) -> dict:
+    return {**DEFAULT_FORECAST_CONFIG, **(config.get("forecast") or {})}
+
+
+def _number(value) -> float | None:
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+class TrendEstimator:
+    __slots__ = (
+        "last_time",
+        "last_charge",
+        "last_runtime",
+        "on_battery",
+        "load",
+        "charge_rate",
+        "drain_ratio",
+        "sum_w",
+        "sum_t",
+        "sum_y",
+        "sum_tt",
+        "sum_ty",
+    )
+
+    def __init__(self):
+        self.last_time: float | None = None
+        self.last_charge: float | None = None
+        self.last_runtime: float | None = None
+        self.on_battery = False
+        self.load: float | None = None
+        # ewma of the charge slope in %/min and of runtime lost per minute of wall clock
+        self.charge_rate = 0.0
+        self.drain_ratio = 1.0
+        self.reset_regression()
+
+    def reset_regression(self) -> None:
+        # weighted sums of a charge over time regression, time is relative to the newest sample
+        self.sum_w = self.sum_t = self.sum_y = self.sum_tt = self.sum_ty = 0.0
+
+    def _regress(self, elapsed: float, charge: float, window: float) -> None:
+        # move the time origin to the new sample, then fade the old sums before adding it at t = 0
+        self.sum_tt -= 2 * elapsed * self.sum_t - elapsed * elapsed * self.sum_w
+        self.sum_ty -= elapsed * self.sum_y
+        self.sum_t -= elapsed * self.sum_w
+        decay = math.exp(-elapsed / window)
+        self.sum_w = self.sum_w * decay + 1
+        self.sum_t *= decay
+        self.sum_y = self.sum_y * decay + charge
+        self.sum_tt *= decay
+        self.sum_ty *= decay
+
+    def slope(self) -> float | None:
+        denominator = self.sum_w * self.sum_tt - self.sum_t * self.sum_t
+        if self.sum_w < 2 or denominator <= 1e-9:
+            return None
+        return (self.sum_w * self.sum_ty - self.sum_t * self.sum_y) / denominator
+
+    def update(self, nut_values, timestamp: float, forecast_config) -> tuple[float, float]:
+        charge = _number(nut_values.get("battery.charge"))
+        runtime = _number(nut_values.get("battery.runtime"))
+        load = _number(nut_values.get("ups.load"))
+        on_battery = "ob" in str(nut_values.get("ups.status", "")).lower().split()
+        minutes = timestamp / 60.0
+
+        # switching between mains and battery, or a big load step, starts a new trend
+        if on_battery != self.on_battery or (
+            load is not None and self.load is not None and abs(load - self.load) >= forecast_config["load_step"]
+        ):
+            self.reset_regression()
+            self.charge_rate, self.drain_ratio = 0.0, 1.0
+            self.load = load
+        self.on_battery = on_battery
+
+        elapsed = minutes - self.last_time if self.last_time is not None else 0.0
+        if elapsed > 0 or self.last_time is None:
+            alpha = 1 - math.exp(-elapsed / forecast_config["rate_window"])
+            if charge is not None and self.last_charge is not None and elapsed > 0:
+                self.charge_rate += alpha * ((charge - self.last_charge) / elapsed - self.charge_rate)
+            if on_battery and runtime is not None and self.last_runtime is not None and elapsed > 0:
+                ratio = (self.last_runtime - runtime) / 60.0 / elapsed
+                self.drain_ratio += alpha * (ratio - self.drain_ratio)
+            if load is not None:
+                self.load = load if self.load is None else self.load + alpha * (load - self.load)
+            if charge is not None:
+                self._regress(elapsed, charge, forecast_config["regression_window"])
+            self.last_time = minutes
+            self.last_charge = charge if charge is not None else self.last_charge
+            self.last_runtime = runtime if runtime is not None else self.last_runtime
+
+        slope = self.slope()
+        charge_rate = self.charge_rate if slope is None else slope
+
+        draining = charge is not None and charge_rate < -forecast_config["min_drain_rate"]
+        # on mains battery.runtime is only what the battery could hold, nothing is running out
+        if not on_battery and not draining:
+            return math.inf, charge_rate
+
+        estimates = []
+        if draining:
+            estimates.append(charge / -charge_rate)
+        if runtime is not None:
+            # a ups whose runtime drops faster than the clock is over-reporting it
+            estimates.append(runtime / 60.0 / max(1.0, self.drain_ratio))
+        time_to_empty = min(estimates) if estimates else math.inf
+        return time_to_empty, charge_rate
+
+
+class TrendEngine:
+    def __init__(self):
+        self.devices: dict[str, TrendEstimator] = {}
+
+    def update_fleet(self, fleet_values, timestamp: float, config) -> None:
+        forecast_config = get_forecast_config(config)
+        # a device that is gone from a server that did answer was removed, unreachable ones keep their trend
+        polled_addresses = {device.rsplit("@", 1)[-1] for device in fleet_values}
+        for device in self.devices.keys() - fleet_values.keys():
+            if device.rsplit("@", 1)[-1] in polled_addresses:
+                del self.devices[device]
+
+        for device, nut_values in fleet_values.items():
+            estimator = self.devices.get(device)
+            if estimator is None:
+                estimator = self.devices[device] = TrendEstimator()
+            time_to_empty, charge_rate = estimator.update(nut_values, timestamp, forecast_config)
+            nut_values[TIME_TO_EMPTY_VARIABLE] = round(time_to_empty, 1)
+            nut_values[CHARGE_RATE_VARIABLE] = round(charge_rate, 3)
+
+
+trend_engine = TrendEngine()
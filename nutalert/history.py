@@ -0,0 +1,189 @@
+import time
+import bisect
+import threading
+
+from array import array
+
+from nutalert.scheduler import get_polling_config
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+DEFAULT_METRICS = (
+    "battery.charge",
+    "battery.runtime",
+    "battery.voltage",
+    "input.voltage",
+    "ups.load",
+)
+DEFAULT_RETENTION_HOURS = 168
+
+# backing arrays start this small and double up to the capacity, so unused retention costs no memory
+INITIAL_BUFFER_SIZE = 64
+
+
+class RingBuffer:
+    __slots__ = ("capacity", "timestamps", "values", "head", "count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        size = min(capacity, INITIAL_BUFFER_SIZE)
+        self.timestamps = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _physical(self, index: int) -> int:
+        return (self.head - self.count + index) % len(self.timestamps)
+
+    def _grow(self) -> None:
+        size = min(self.capacity, 2 * len(self.timestamps))
+        timestamps, values = self.slice()
+        padding = array("d", bytes(8 * (size - self.count)))
+        timestamps.extend(padding)
+        values.extend(padding)
+        self.timestamps, self.values = timestamps, values
+        self.head = self.count
+
+    def append(self, timestamp: float, value: float) -> None:
+        if self.count == len(self.timestamps) < self.capacity:
+            self._grow()
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.timestamps)
+        if self.count < self.capacity:
+            self.count += 1
+
+    def latest(self) -> tuple[float, float] | None:
+        if not self.count:
+            return None
+        index = self._physical(self.count - 1)
+        return self.timestamps[index], self.values[index]
+
+    def slice(self, start: int = 0, stop: int | None = None) -> tuple[array, array]:
+        stop = self.count if stop is None else stop
+        if stop <= start:
+            return array("d"), array("d")
+        first, last = self._physical(start), self._physical(stop - 1) + 1
+        if first < last:
+            return self.timestamps[first:last], self.values[first:last]
+        # the range wraps around the end of the backing arrays
+        return (
+            self.timestamps[first:] + self.timestamps[:last],
+            self.values[first:] + self.values[:last],
+        )
+
+    def items(self, start: int = 0, stop: int | None = None):
+        return zip(*self.slice(start, stop))
+
+    def index_of(self, timestamp: float) -> int:
+        return bisect.bisect_left(_TimestampView(self), timestamp)
+
+    def resized(self, capacity: int) -> "RingBuffer":
+        buffer = RingBuffer(capacity)
+        for timestamp, value in self.items(max(0, self.count - capacity)):
+            buffer.append(timestamp, value)
+        return buffer
+
+
+class _TimestampView:
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer: RingBuffer):
+        self.buffer = buffer
+
+    def __len__(self) -> int:
+        return self.buffer.count
+
+    def __getitem__(self, index: int) -> float:
+        return self.buffer.timestamps[self.buffer._physical(index)]
+
+
+def downsample(samples, start: float, end: float, buckets: int) -> list[tuple[float, float, float, float]]:
+    width = (end - start) / buckets
+    mins = [float("inf")] * buckets
+    maxs = [float("-inf")] * buckets
+    sums = [0.0] * buckets
+    counts = [0] * buckets
+    for timestamp, value in samples:
+        bucket = min(int((timestamp - start) / width), buckets - 1)
+        if value < mins[bucket]:
+            mins[bucket] = value
+        if value > maxs[bucket]:
+            maxs[bucket] = value
+        sums[bucket] += value
+        counts[bucket] += 1
+    return [
+        (start + bucket * width, mins[bucket], maxs[bucket], sums[bucket] / counts[bucket])
+        for bucket in range(buckets)
+        if counts[bucket]
+    ]
+
+
+class MetricHistory:
+    def __init__(self, capacity: int = 1, metrics=DEFAULT_METRICS):
+        self.capacity = capacity
+        self.metrics = tuple(metrics)
+        self._series: dict[tuple[str, str], RingBuffer] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, capacity: int, metrics=DEFAULT_METRICS) -> None:
+        metrics = tuple(metrics)
+        if capacity == self.capacity and metrics == self.metrics:
+            return
+        with self._lock:
+            if capacity != self.capacity:
+                logger.info(f"resizing metric history to {capacity} samples per series")
+                self._series = {key: buffer.resized(capacity) for key, buffer in self._series.items()}
+            self.capacity = capacity
+            self.metrics = metrics
+
+    def record(self, device: str, nut_values, timestamp: float | None = None) -> None:
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for metric in self.metrics:
+                value = nut_values.get(metric)
+                if not isinstance(value, (int, float)):
+                    continue
+                buffer = self._series.get((device, metric))
+                if buffer is None:
+                    buffer = self._series[(device, metric)] = RingBuffer(self.capacity)
+                buffer.append(timestamp, value)
+
+    def record_fleet(self, snapshots) -> None:
+        for device, snapshot in snapshots.items():
+            if snapshot["nut_values"]:
+                self.record(device, snapshot["nut_values"], snapshot["timestamp"])
+
+    def devices(self) -> list[str]:
+        return sorted({device for device, _ in self._series})
+
+    def query(
+        self, device: str, metric: str, start: float, end: float | None = None, buckets: int = 0
+    ) -> list[tuple[float, float, float, float]]:
+        end = time.time() if end is None else end
+        with self._lock:
+            buffer = self._series.get((device, metric))
+            if buffer is None or end <= start:
+                return []
+            timestamps, values = buffer.slice(buffer.index_of(start), buffer.index_of(end))
+        if not buckets:
+            return [(timestamp, value, value, value) for timestamp, value in zip(timestamps, values)]
+        return downsample(zip(timestamps, values), start, end, buckets)
+
+
+metric_history = MetricHistory()
+
+
+def get_history_capacity(config) -> int:
+    history_config = config.get("history") or {}
+    retention_hours = history_config.get("retention_hours", DEFAULT_RETENTION_HOURS)
+    # sized for the fastest polling, during an outage the fast interval must still cover the whole retention
+    polling_config = get_polling_config(config)
+    interval = min(polling_config["interval"], polling_config["fast_interval"])
+    return max(1, int(retention_hours * 3600 / max(1, interval)))
@@ -0,0 +1,174 @@
+import re
+import math
+import time
+
+from bisect import bisect_left
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from a pipelined GET VAR on localhost up to a notification send that hit its timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGES = ("connect", "fetch", "parse", "alert", "notify", "poll")
+
+COUNTER_HELP = {
+    "nutalert_alerts_total": "alert state changes by rule and new state",
+    "nutalert_notifications_total": "notification deliveries by result",
+    "nutalert_errors_total": "errors by pipeline stage",
+}
+
+METRIC_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def metric_name(variable: str) -> str:
+    return "nut_" + METRIC_NAME_PATTERN.sub("_", variable)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # one slot per bucket plus the overflow, made cumulative when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name: str, labels) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels((*labels, ('le', format_value(bound))))} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.total!r}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {stage: Histogram() for stage in STAGES}
+        # (name, sorted label pairs) -> value
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.snapshots: dict[str, dict] = {}
+        self.started_at = time.time()
+        self.payload = b""
+        self.polls = 0
+        # callables returning ready exposition lines for state kept outside the registry
+        self.collectors = []
+
+    def add_collector(self, collector) -> None:
+        self.collectors.append(collector)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def publish(self, snapshots) -> None:
+        # a device missing from a server that did answer was removed, unreachable ones keep their last values
+        polled_addresses = {device.rsplit("@", 1)[-1] for device in snapshots}
+        for device in self.snapshots.keys() - snapshots.keys():
+            if device.rsplit("@", 1)[-1] in polled_addresses:
+                del self.snapshots[device]
+        self.snapshots.update(snapshots)
+        self.polls += 1
+
+        start = time.perf_counter()
+        self.payload = self.render().encode()
+        logger.debug(
+            f"metrics rendered in {(time.perf_counter() - start) * 1000:.1f}ms ({len(self.payload)} bytes)",
+            extra={"stage": "metrics"},
+        )
+
+    def _render_devices(self) -> list[str]:
+        series: dict[str, list[str]] = {}
+        status_lines, state_lines = [], {"alerting": [], "stale": [], "age_seconds": []}
+        for device, snapshot in sorted(self.snapshots.items()):
+            ups, _, server = device.rpartition("@")
+            labels = (("device", device), ("ups", ups), ("server", server))
+            for variable, value in snapshot["nut_values"].items():
+                if isinstance(value, (int, float)):
+                    series.setdefault(metric_name(variable), []).append(
+                        f"{format_labels(labels)} {format_value(value)}"
+                    )
+            status = snapshot["nut_values"].get("ups.status")
+            if isinstance(status, str):
+                status_lines.append(f"{format_labels((*labels, ('status', status)))} 1")
+            state_lines["alerting"].append(f"{format_labels(labels)} {int(snapshot['is_alerting'])}")
+            state_lines["stale"].append(f"{format_labels(labels)} {int(snapshot['stale'])}")
+            if snapshot["age"] is not None:
+                state_lines["age_seconds"].append(f"{format_labels(labels)} {snapshot['age']!r}")
+
+        lines = []
+        for name, samples in sorted(series.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{sample}" for sample in samples)
+        if status_lines:
+            lines.append("# HELP nut_ups_status_info current ups.status of the device")
+            lines.append("# TYPE nut_ups_status_info gauge")
+            lines.extend(f"nut_ups_status_info{sample}" for sample in status_lines)
+        for state, samples in state_lines.items():
+            if samples:
+                lines.append(f"# TYPE nutalert_ups_{state} gauge")
+                lines.extend(f"nutalert_ups_{state}{sample}" for sample in samples)
+        return lines
+
+    def render(self) -> str:
+        lines = self._render_devices()
+
+        lines.append("# HELP nutalert_stage_duration_seconds time spent per poll pipeline stage")
+        lines.append("# TYPE nutalert_stage_duration_seconds histogram")
+        for stage, histogram in self.histograms.items():
+            lines.extend(histogram.render("nutalert_stage_duration_seconds", (("stage", stage),)))
+
+        for name, help_text in COUNTER_HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter, labels), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        for collector in self.collectors:
+            lines.extend(collector())
+
+        lines.append("# TYPE nutalert_polls_total counter")
+        lines.append(f"nutalert_polls_total {self.polls}")
+        lines.append("# TYPE nutalert_start_time_seconds gauge")
+        lines.append(f"nutalert_start_time_seconds {self.started_at!r}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,147 @@
+from typing import Optional, List
+
+from pydantic import BaseModel, Field, model_validator
+
+from nutalert.alert import compile_formula
+from nutalert.history import DEFAULT_METRICS, DEFAULT_RETENTION_HOURS
+
+
+class MinMaxAlert(BaseModel):
+    enabled: bool = False
+    min: Optional[float] = None
+    max: Optional[float] = None
+    hysteresis: float = Field(default=0, ge=0, description="hysteresis must be 0 or greater")
+    message: Optional[str] = None
+
+
+class StatusAlert(BaseModel):
+    enabled: bool = False
+    acceptable: List[str] = []
+    message: Optional[str] = None
+    alert_when_status_changed: bool = False
+
+
+class BasicAlerts(BaseModel):
+    battery_charge: Optional[MinMaxAlert] = None
+    runtime: Optional[MinMaxAlert] = None
+    load: Optional[MinMaxAlert] = None
+    input_voltage: Optional[MinMaxAlert] = None
+    ups_status: Optional[StatusAlert] = None
+    time_to_empty: Optional[MinMaxAlert] = None
+    charge_rate: Optional[MinMaxAlert] = None
+
+
+class AlertPolicyConfig(BaseModel):
+    fire_after: int = Field(default=1, ge=1, description="fire_after must be 1 or greater")
+    resolve_after: int = Field(default=1, ge=1, description="resolve_after must be 1 or greater")
+    coalesce_window: float = Field(default=0, ge=0, description="coalesce_window must be 0 or greater")
+    notify_resolved: bool = False
+
+
+class PollingConfig(BaseModel):
+    fast_interval: float = Field(default=5, gt=0, description="fast_interval must be positive")
+    slow_interval: float = Field(default=60, gt=0, description="slow_interval must be positive")
+    stable_polls: int = Field(default=10, ge=1, description="stable_polls must be 1 or greater")
+    jitter: float = Field(default=0.1, ge=0, lt=1, description="jitter must be between 0 and 1")
+
+
+class ForecastConfig(BaseModel):
+    rate_window: float = Field(default=5, gt=0, description="rate_window must be positive")
+    regression_window: float = Field(default=10, gt=0, description="regression_window must be positive")
+    load_step: float = Field(default=15, gt=0, description="load_step must be positive")
+    min_drain_rate: float = Field(default=0.01, ge=0, description="min_drain_rate must be 0 or greater")
+
+
+class NutServerConfig(BaseModel):
+    host: str
+    port: int = Field(gt=0, le=65535, description="Port must be between 1 and 65535")
+    timeout: int = Field(gt=0, description="Timeout must be a positive number")
+    devices: Optional[List[str]] = None
+
+
+class FormulaAlert(BaseModel):
+    expression: str
+    message: str
+
+    @model_validator(mode="after")
+    def check_formula(self):
+        formula = compile_formula(self.expression, self.message)
+        if formula.error:
+            raise ValueError(formula.error)
+        return self
+
+
+class HistoryConfig(BaseModel):
+    retention_hours: float = Field(
+        default=DEFAULT_RETENTION_HOURS, gt=0, description="retention_hours must be positive"
+    )
+    metrics: List[str] = list(DEFAULT_METRICS)
+
+
+class StorageConfig(BaseModel):
+    enabled: bool = False
+    path: Optional[str] = None
+    flush_interval: float = Field(default=10, gt=0, description="flush_interval must be positive")
+    batch_size: int = Field(default=1000, gt=0, description="batch_size must be positive")
+    max_queue: int = Field(default=100000, gt=0, description="max_queue must be positive")
+    raw_retention_days: float = Field(default=7, gt=0, description="raw_retention_days must be positive")
+    hourly_retention_days: float = Field(default=90, gt=0, description="hourly_retention_days must be positive")
+    daily_retention_days: float = Field(default=730, gt=0, description="daily_retention_days must be positive")
+
+
+class LogFileConfig(BaseModel):
+    path: Optional[str] = None
+    max_bytes: int = Field(default=10485760, ge=0, description="max_bytes must be 0 or greater")
+    backup_count: int = Field(default=5, ge=0, description="backup_count must be 0 or greater")
+
+
+class RecordingConfig(BaseModel):
+    enabled: bool = False
+    path: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_path(self):
+        if self.enabled and not self.path:
+            raise ValueError("recording.path is required when recording is enabled")
+        return self
+
+
+class ProxyConfig(BaseModel):
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = Field(default=3493, gt=0, le=65535, description="Port must be between 1 and 65535")
+    max_staleness: float = Field(default=30, gt=0, description="max_staleness must be positive")
+
+
+class ProfilingConfig(BaseModel):
+    spans: bool = False
+    admin: bool = False
+
+
+class AppConfig(BaseModel):
+    nut_server: Optional[NutServerConfig] = None
+    nut_servers: Optional[List[NutServerConfig]] = None
+    max_concurrent_polls: int = Field(default=16, gt=0, description="max_concurrent_polls must be positive")
+    minimal_fetch: bool = False
+    inventory_interval: int = Field(default=300, ge=5, description="inventory_interval must be 5 seconds or greater")
+    check_interval: int = Field(ge=5, description="check_interval must be 5 seconds or greater")
+    polling: Optional[PollingConfig] = None
+    stale_after: float = Field(default=60, gt=0, description="stale_after must be positive")
+    alert_mode: str
+    basic_alerts: Optional[BasicAlerts] = None
+    alert_policy: Optional[AlertPolicyConfig] = None
+    forecast: Optional[ForecastConfig] = None
+    formula_alert: Optional[FormulaAlert] = None
+    history: Optional[HistoryConfig] = None
+    storage: Optional[StorageConfig] = None
+    log_buffer_size: int = Field(default=1000, ge=10, description="log_buffer_size must be 10 lines or greater")
+    log_file: Optional[LogFileConfig] = None
+    profiling: Optional[ProfilingConfig] = None
+    recording: Optional[RecordingConfig] = None
+    proxy: Optional[ProxyConfig] = None
+
+    @model_validator(mode="after")
+    def check_nut_servers(self):
+        if self.nut_server is None and not self.nut_servers:
+            raise ValueError("either nut_server or nut_servers must be specified")
+        return self
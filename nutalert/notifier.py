@@ -1,50 +1,82 @@
-import apprise
+import time
+import asyncio
+
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from nutalert.utils import setup_logger
+from nutalert.metrics import metrics_registry, format_labels, format_value
+from nutalert.tracing import traced
 
 
 logger = setup_logger(__name__)
 
 
+MAX_BODY_LENGTH = 1900
+
+DEFAULT_DISPATCH_CONFIG = {
+    "timeout": 10,
+    "retries": 3,
+    "retry_backoff": 2,
+    "queue_size": 100,
+}
+
+# apprise plugins block and cannot be interrupted, a timed out send keeps its thread until it returns
+MAX_SEND_THREADS = 8
+
+legacy_apprise_warned = False
+
+
+def get_notification_urls(config) -> list[str]:
+    global legacy_apprise_warned
+    notifications_cfg = config.get("notifications", {})
+    urls_config = []
+
+    if "apprise" in notifications_cfg:
+        if not legacy_apprise_warned:
+            logger.warning("using legacy 'apprise' key in config. please update to the new format.")
+            legacy_apprise_warned = True
+        apprise_cfg = notifications_cfg.get("apprise", {})
+        urls_config = list(apprise_cfg.get("urls", []))
+        if "url" in apprise_cfg and isinstance(apprise_cfg["url"], str):
+            urls_config.append(apprise_cfg["url"])
+    else:
+        urls_config = notifications_cfg.get("urls", [])
+
+    if all(isinstance(item, str) for item in urls_config):
+        return [url for url in urls_config if url]
+    if all(isinstance(item, Mapping) for item in urls_config):
+        return [item["url"] for item in urls_config if item.get("enabled", True) and item.get("url")]
+    return []
+
+
+def shorten_body(message: str) -> str:
+    prefix = "this message had to be shortened: \n" if len(message) > MAX_BODY_LENGTH else ""
+    return prefix + message[:MAX_BODY_LENGTH]
+
+
 class NutAlertNotifier:
     def __init__(self, config, container_name: str | None = None):
         self.config = config
         self.container = container_name
 
     def notify_apprise(self, title: str, message: str, file_path: str | None = None) -> bool:
-        ap_obj = apprise.Apprise()
-        notifications_cfg = self.config.get("notifications", {})
-        urls_config = []
+        import apprise
 
-        if "apprise" in notifications_cfg:
-            logger.warning("using legacy 'apprise' key in config. please update to the new format.")
-            apprise_cfg = notifications_cfg.get("apprise", {})
-            urls_config = apprise_cfg.get("urls", [])
-            if "url" in apprise_cfg and isinstance(apprise_cfg["url"], str):
-                urls_config.append(apprise_cfg["url"])
-        else:
-            urls_config = notifications_cfg.get("urls", [])
-
-        if not urls_config:
+        ap_obj = apprise.Apprise()
+        urls = get_notification_urls(self.config)
+        if not urls:
             logger.error("no apprise urls found in configuration.")
             return False
 
-        if all(isinstance(item, str) for item in urls_config):
-            for url in urls_config:
-                if url:
-                    ap_obj.add(url)
-        elif all(isinstance(item, dict) for item in urls_config):
-            for item in urls_config:
-                if item.get("enabled", True):
-                    url = item.get("url")
-                    if url:
-                        ap_obj.add(url)
+        for url in urls:
+            ap_obj.add(url)
 
         if not ap_obj.servers:
             logger.error("no enabled and valid apprise urls found")
             return False
 
-        short_body = ("this message had to be shortened: \n" if len(message) > 1900 else "") + message[:1900]
+        short_body = shorten_body(message)
         try:
             if file_path:
                 ap_obj.notify(title=title, body=short_body, attach=file_path)
@@ -56,17 +88,181 @@ class NutAlertNotifier:
             logger.error("error sending apprise notification: %s", exc)
             return False
 
-    def send_all(self, title: str, message: str, file_path: str | None = None) -> None:
-        notifications_cfg = self.config.get("notifications", {})
 
-        if notifications_cfg.get("enabled", False) and notifications_cfg.get("urls"):
-            self.notify_apprise(title, message, file_path)
+class NotificationTarget:
+    def __init__(self, url: str, plugin):
+        self.plugin = plugin
+        self.name = plugin.url(privacy=True).split("?", 1)[0]
+        self.sent = 0
+        self.failed = 0
+        self.last_latency_ms: float | None = None
+        self.last_error: str | None = None
+        # a send that timed out but whose thread is still running, the target is skipped until it returns
+        self.pending: Future | None = None
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "last_latency_ms": self.last_latency_ms,
+            "last_error": self.last_error,
+            "busy": self.pending is not None and not self.pending.done(),
+        }
+
+
+class NotificationDispatcher:
+    def __init__(self):
+        self.settings = dict(DEFAULT_DISPATCH_CONFIG)
+        self.targets: list[NotificationTarget] = []
+        self.dropped = 0
+        self._urls: tuple[str, ...] | None = None
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    def configure(self, config) -> None:
+        notifications_cfg = config.get("notifications", {})
+        self.settings = {key: notifications_cfg.get(key, default) for key, default in DEFAULT_DISPATCH_CONFIG.items()}
+        urls = tuple(get_notification_urls(config))
+        if urls == self._urls:
             return
+        # apprise loads all of its plugins on import, so it is only imported once notifications are configured
+        import apprise
 
-        apprise_cfg = notifications_cfg.get("apprise", {})
-        if (
-            "apprise" in notifications_cfg
-            and apprise_cfg.get("enabled", False)
-            and (apprise_cfg.get("url") or apprise_cfg.get("urls"))
-        ):
-            self.notify_apprise(title, message, file_path)
+        # apprise urls are parsed once per config change instead of on every alert
+        targets = []
+        for url in urls:
+            plugin = apprise.Apprise.instantiate(url)
+            if plugin is None:
+                logger.error(f"invalid apprise url skipped: {url.split('://', 1)[0]}://...")
+                continue
+            plugin.socket_connect_timeout = plugin.socket_read_timeout = self.settings["timeout"]
+            targets.append(NotificationTarget(url, plugin))
+        self.targets = targets
+        self._urls = urls
+        logger.info(f"notification dispatcher configured with {len(targets)} target(s)")
+
+    @traced("notification_submit")
+    def submit(self, title: str, message: str) -> bool:
+        if not self.targets:
+            logger.error("no enabled and valid apprise urls found")
+            return False
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.settings["queue_size"])
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            metrics_registry.inc("nutalert_notifications_total", result="dropped")
+            logger.warning(f"notification queue is full, dropped the oldest notification ({self.dropped} so far)")
+        self._queue.put_nowait((title, shorten_body(message), time.monotonic()))
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            title, body, queued_at = await self._queue.get()
+            targets = self.targets
+            results = await asyncio.gather(*(self._send(target, title, body) for target in targets))
+            elapsed_ms = (time.monotonic() - queued_at) * 1000
+            logger.info(
+                f"notification delivered to {sum(results)}/{len(targets)} target(s) in {elapsed_ms:.1f}ms",
+                extra={"stage": "notify", "duration": round(elapsed_ms, 1)},
+            )
+
+    @traced("notification_send")
+    async def _send(self, target: NotificationTarget, title: str, body: str) -> bool:
+        retries, timeout = self.settings["retries"], self.settings["timeout"]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=MAX_SEND_THREADS, thread_name_prefix="notify")
+        for attempt in range(retries + 1):
+            if target.pending is not None and not target.pending.done():
+                target.last_error = "previous notification is still being sent"
+                break
+            start = time.perf_counter()
+            future = self._executor.submit(target.plugin.notify, title=title, body=body)
+            try:
+                delivered = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+                error = None if delivered else "target rejected the notification"
+            except asyncio.TimeoutError:
+                error = f"timed out after {timeout}s"
+                # a send that never got a thread can be retried, one that started may still deliver it
+                if not future.cancel():
+                    target.pending = future
+            except Exception as e:
+                error = str(e)
+            latency_ms = (time.perf_counter() - start) * 1000
+
+            metrics_registry.observe("notify", latency_ms / 1000)
+            if error is None:
+                target.sent += 1
+                target.last_latency_ms = latency_ms
+                target.last_error = None
+                metrics_registry.inc("nutalert_notifications_total", result="sent")
+                logger.info(
+                    f"notification sent to {target.name} in {latency_ms:.1f}ms",
+                    extra={"stage": "notify", "duration": round(latency_ms, 1)},
+                )
+                return True
+
+            target.last_error = error
+            if target.pending is future:
+                break
+            if attempt < retries:
+                delay = self.settings["retry_backoff"] * 2**attempt
+                logger.warning(f"notification to {target.name} failed ({error}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+        target.failed += 1
+        metrics_registry.inc("nutalert_notifications_total", result="failed")
+        logger.error(f"notification to {target.name} failed after {attempt + 1} attempt(s): {target.last_error}")
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "dropped": self.dropped,
+            "targets": {target.name: target.stats() for target in self.targets},
+        }
+
+    def metric_lines(self) -> list[str]:
+        stats = self.stats()
+        lines = [
+            "# TYPE nutalert_notification_queue_length gauge",
+            f"nutalert_notification_queue_length {stats['queued']}",
+        ]
+        series = {
+            "sent_total": ("counter", lambda target_stats: target_stats["sent"]),
+            "failed_total": ("counter", lambda target_stats: target_stats["failed"]),
+            # 0 once the last send to a target failed, until it delivers again
+            "up": ("gauge", lambda target_stats: int(target_stats["last_error"] is None)),
+            "busy": ("gauge", lambda target_stats: int(target_stats["busy"])),
+            "last_latency_seconds": (
+                "gauge",
+                lambda target_stats: (
+                    None if target_stats["last_latency_ms"] is None else target_stats["last_latency_ms"] / 1000
+                ),
+            ),
+        }
+        for suffix, (kind, value_of) in series.items():
+            name = f"nutalert_notification_target_{suffix}"
+            samples = [
+                f"{name}{format_labels((('target', target),))} {format_value(value)}"
+                for target, target_stats in stats["targets"].items()
+                if (value := value_of(target_stats)) is not None
+            ]
+            if samples:
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(samples)
+        return lines
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+notification_dispatcher = NotificationDispatcher()
+metrics_registry.add_collector(notification_dispatcher.metric_lines)
@@ -1,13 +1,15 @@
 import re
 
 from nutalert.utils import setup_logger
+from nutalert.tracing import traced
 
 
 logger = setup_logger(__name__)
 
 
+@traced("parse_nut_data")
 def parse_nut_data(raw_data):
-    pattern = re.compile(r'^VAR ups\s+([^ ]+)\s+"([^"]+)"$')
+    pattern = re.compile(r'^VAR \S+\s+([^ ]+)\s+"([^"]+)"$')
     nut_values = {}
     for line in raw_data.splitlines():
         m = pattern.match(line.strip())
@@ -21,3 +23,24 @@ def parse_nut_data(raw_data):
                 except ValueError:
                     nut_values[key] = value.strip()
     return nut_values
+
+
+def parse_raw_values(raw_data):
+    # keeps the values as the text upsd sent, for serving them again over the nut protocol
+    pattern = re.compile(r'^VAR \S+\s+(\S+)\s+"(.*)"$')
+    values = {}
+    for line in raw_data.splitlines():
+        m = pattern.match(line.strip())
+        if m:
+            values[m.group(1)] = m.group(2)
+    return values
+
+
+def parse_ups_list(raw_data):
+    pattern = re.compile(r'^UPS\s+(\S+)\s+"[^"]*"$')
+    devices = []
+    for line in raw_data.splitlines():
+        m = pattern.match(line.strip())
+        if m:
+            devices.append(m.group(1))
+    return devices
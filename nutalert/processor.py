@@ -1,66 +1,231 @@
+import math
 import time
 
-from nutalert.alert import should_alert
+from nutalert.alert import evaluate_alerts_fleet, get_required_variables
 from nutalert.parser import parse_nut_data
-from nutalert.fetcher import fetch_nut_data
-from nutalert.notifier import NutAlertNotifier
-from nutalert.utils import setup_logger, load_config, get_recent_logs
+from nutalert.fetcher import fetch_fleet
+from nutalert.history import metric_history, get_history_capacity, DEFAULT_METRICS
+from nutalert.storage import get_history_store_async
+from nutalert.notifier import notification_dispatcher
+from nutalert.tracker import alert_tracker, get_alert_policy, format_notification
+from nutalert.scheduler import poll_scheduler, server_address
+from nutalert.forecast import trend_engine
+from nutalert.metrics import metrics_registry
+from nutalert.tracing import tracer
+from nutalert.trace import trace_recorder
+from nutalert.proxy import proxy_cache, get_proxy_config
+from nutalert.stream import snapshot_stream
+from nutalert.utils import setup_logger, load_config, configure_logging
 
 
 logger = setup_logger(__name__)
 
 
-last_notification_time: float = 0.0
+# -inf until the first inventory poll, time.monotonic() can be smaller than inventory_interval on a fresh host
+last_inventory_time: float = -math.inf
 
+DASHBOARD_VARIABLES = {"ups.status", "ups.load", "battery.charge", "battery.runtime", "input.voltage"}
 
-def get_ups_data_and_alerts():
-    global last_notification_time
-    config = load_config()
+# full LIST VAR values per device from the last inventory poll, shown in the raw data panel
+inventory: dict[str, dict] = {}
 
-    default_return = {}, "configuration error", True, get_recent_logs()
+# last snapshot with real data per device, served while its nut server is unreachable
+last_good: dict[str, dict] = {}
 
-    if not config or "nut_server" not in config:
-        logger.error("'nut_server' section is missing in the configuration.")
-        return default_return
 
-    nut_server_config = config["nut_server"]
+def get_nut_servers(config):
+    servers = list(config.get("nut_servers") or [])
+    if "nut_server" in config:
+        servers.insert(0, config["nut_server"])
+
     required_keys = ["host", "port", "timeout"]
-    if not all(key in nut_server_config for key in required_keys):
-        logger.error(f"nut_server config is missing one of required keys: {required_keys}")
-        return default_return
+    valid_servers = []
+    for server in servers:
+        if not all(key in server for key in required_keys):
+            logger.error(f"nut_server config is missing one of required keys: {required_keys}")
+            continue
+        valid_servers.append(server)
+    return valid_servers
 
-    raw_data = fetch_nut_data(
-        host=nut_server_config["host"],
-        port=nut_server_config["port"],
-        timeout=nut_server_config["timeout"],
-    )
 
-    if not raw_data:
-        logger.error("no data received from nut server. check connection and server status.")
-        return {}, "error: no data from nut server", True, get_recent_logs()
+def prune_devices(states, servers, snapshots) -> list[str]:
+    # a device goes away with its server leaving the config, or when a server that just answered no longer lists it
+    addresses = {server_address(server) for server in servers}
+    polled_addresses = {device.rsplit("@", 1)[-1] for device in snapshots}
+    removed = [
+        device
+        for device in states
+        if (address := device.rsplit("@", 1)[-1]) not in addresses
+        or (address in polled_addresses and device not in snapshots)
+    ]
+    for device in removed:
+        del states[device]
+    return removed
 
-    nut_values = parse_nut_data(raw_data)
-    is_alerting, alert_message = should_alert(nut_values, config)
 
+def get_fetch_variables(config):
+    if not config.get("minimal_fetch", False):
+        return None
+    if time.monotonic() - last_inventory_time >= config.get("inventory_interval", 300):
+        return None
+    history_metrics = (config.get("history") or {}).get("metrics", DEFAULT_METRICS)
+    return sorted(get_required_variables(config) | DASHBOARD_VARIABLES | set(history_metrics))
+
+
+def _log_alert_result(device, is_alerting, alert_message):
     if is_alerting:
         if "config error" not in alert_message.lower():
-            logger.warning(f"alert triggered: {alert_message}")
-            notifications_config = config.get("notifications", {})
-            if notifications_config.get("enabled", False):
-                cooldown = notifications_config.get("cooldown", 60)
-                current_time = time.time()
-                if current_time - last_notification_time > cooldown:
-                    logger.info(f"cooldown period ({cooldown}s) has passed. sending notification.")
-                    notifier = NutAlertNotifier(config)
-                    notifier.send_all(title="UPS Alert", message=alert_message)
-                    last_notification_time = current_time
-                else:
-                    logger.info(
-                        f"cooldown period ({cooldown}s) has not passed. skipping notification. "
-                        f"last notification sent {current_time - last_notification_time:.0f}s ago"
-                    )
+            logger.warning(f"alert triggered for {device}: {alert_message}", extra={"device": device, "stage": "alert"})
     else:
         ok_status = alert_message.split(":", 1)[-1].strip() if ":" in alert_message else alert_message
-        logger.info(f"status ok: {ok_status}")
+        logger.info(f"status ok for {device}: {ok_status}", extra={"device": device, "stage": "alert"})
+
+
+def get_stale_snapshot(previous, timestamp, config):
+    age = timestamp - previous["timestamp"]
+    alert_rules = previous["alert_rules"]
+    messages = [previous["alert_message"]] if previous["is_alerting"] else []
+    # the previous rule results are kept as they were so a server dropping out does not resolve its alerts
+    if age >= config.get("stale_after", 60):
+        stale_message = f"data stale: no update for {age:.0f}s"
+        alert_rules = {**alert_rules, "stale": (True, stale_message)}
+        messages.insert(0, stale_message)
+    return {
+        **previous,
+        "alert_message": "; ".join(messages) or previous["alert_message"],
+        "is_alerting": bool(messages),
+        "alert_rules": alert_rules,
+        "stale": True,
+        "age": age,
+    }
+
+
+def process_fleet(raw_by_device, config, base_values_by_device=None):
+    timestamp = time.time()
+    snapshots = dict.fromkeys(raw_by_device)
+    fleet_values = {}
+
+    for device, raw_data in raw_by_device.items():
+        if not raw_data:
+            previous = last_good.get(device)
+            if previous is not None:
+                snapshots[device] = get_stale_snapshot(previous, timestamp, config)
+                continue
+            logger.error(
+                f"no data received for {device}. check connection and server status.",
+                extra={"device": device, "stage": "parse"},
+            )
+            metrics_registry.inc("nutalert_errors_total", stage="parse")
+            snapshots[device] = {
+                "device": device,
+                "timestamp": timestamp,
+                "nut_values": {},
+                "alert_message": "error: no data from nut server",
+                "is_alerting": True,
+                "alert_rules": {},
+                "stale": False,
+                "age": None,
+            }
+            continue
+
+        start = time.perf_counter()
+        nut_values = parse_nut_data(raw_data)
+        metrics_registry.observe("parse", time.perf_counter() - start)
+        base_values = (base_values_by_device or {}).get(device)
+        fleet_values[device] = {**base_values, **nut_values} if base_values else nut_values
+
+    # the forecast values are added to the nut values so rules and formulas can use them
+    trend_engine.update_fleet(fleet_values, timestamp, config)
+    # every device is checked against the compiled rules in one pass
+    start = time.perf_counter()
+    results = evaluate_alerts_fleet(list(fleet_values.values()), config)
+    metrics_registry.observe("alert", time.perf_counter() - start)
+    for (device, nut_values), (is_alerting, alert_message, alert_rules) in zip(fleet_values.items(), results):
+        _log_alert_result(device, is_alerting, alert_message)
+        snapshots[device] = {
+            "device": device,
+            "timestamp": timestamp,
+            "nut_values": nut_values,
+            "alert_message": alert_message,
+            "is_alerting": is_alerting,
+            "alert_rules": alert_rules,
+            "stale": False,
+            "age": 0.0,
+        }
+        last_good[device] = snapshots[device]
+    return snapshots
+
+
+def notify_alerts(snapshots, config):
+    # devices without data keep their alert state until they report again
+    rules_by_device = {
+        device: {
+            rule: result for rule, result in snapshot["alert_rules"].items() if "config error" not in result[1].lower()
+        }
+        for device, snapshot in snapshots.items()
+        if snapshot["nut_values"]
+    }
+    events = alert_tracker.update(rules_by_device, get_alert_policy(config))
+    for kind, _, rule, _ in events:
+        metrics_registry.inc("nutalert_alerts_total", rule=rule, state=kind)
+
+    notifications_config = config.get("notifications", {})
+    if not events or not notifications_config.get("enabled", False):
+        return
+
+    title, alert_message = format_notification(events, single_device=len(last_good.keys() | snapshots.keys()) == 1)
+    logger.info(f"sending notification for {len(events)} alert change(s)")
+    notification_dispatcher.configure(config)
+    notification_dispatcher.submit(title, alert_message)
+
+
+async def get_ups_data_and_alerts():
+    global last_inventory_time
+    start = time.perf_counter()
+    config = load_config()
+    servers = get_nut_servers(config) if config else []
+    if config:
+        configure_logging(config)
+        tracer.configure(config)
+        trace_recorder.configure(config)
+
+    if not servers:
+        logger.error("'nut_server' section is missing in the configuration.")
+        metrics_registry.inc("nutalert_errors_total", stage="config")
+        poll_scheduler.retry_later(config)
+        return {}
+
+    variables = get_fetch_variables(config)
+    # inventory polls cover every server so the raw data panel stays complete
+    polled = servers if config.get("minimal_fetch", False) and variables is None else poll_scheduler.due(servers)
+    raw_by_device = await fetch_fleet(polled, config.get("max_concurrent_polls", 16), variables)
+    trace_recorder.record(raw_by_device, time.time())
+    if get_proxy_config(config)["enabled"]:
+        proxy_cache.update(raw_by_device, polled, config)
+
+    snapshots = process_fleet(raw_by_device, config, inventory if variables else None)
+    if variables is None:
+        inventory.update(
+            (device, snapshot["nut_values"]) for device, snapshot in snapshots.items() if snapshot["nut_values"]
+        )
+        last_inventory_time = time.monotonic()
+
+    history_metrics = (config.get("history") or {}).get("metrics", DEFAULT_METRICS)
+    metric_history.configure(get_history_capacity(config), history_metrics)
+    fresh = {device: snapshot for device, snapshot in snapshots.items() if not snapshot["stale"]}
+    metric_history.record_fleet(fresh)
+    history_store = await get_history_store_async(config)
+    if history_store is not None:
+        history_store.add_fleet(fresh, history_metrics)
+    poll_scheduler.update(polled, snapshots, config)
+    for states in (last_good, inventory, trend_engine.devices, poll_scheduler.devices):
+        prune_devices(states, servers, snapshots)
+    for device in prune_devices(alert_tracker.states, servers, snapshots):
+        logger.info(f"dropped the alert state of {device}, it is no longer polled", extra={"device": device})
+    notify_alerts(snapshots, config)
+    metrics_registry.observe("poll", time.perf_counter() - start)
+    # scrapes of /metrics only read this payload, they never reach upsd
+    metrics_registry.publish(snapshots)
+    snapshot_stream.publish(snapshots)
 
-    return nut_values, alert_message, is_alerting, get_recent_logs()
+    return snapshots
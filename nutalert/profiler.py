@@ -0,0 +1,110 @@
+import sys
+import time
+import asyncio
+import threading
+import tracemalloc
+
+from collections import Counter
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+MAX_PROFILE_SECONDS = 300
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+
+_profile_lock = asyncio.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> tuple[Counter, int]:
+    # a plain sampling profiler: walk every other thread's current frame at a fixed interval
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks: Counter = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(labels))] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def format_cpu_profile(stacks: Counter, samples: int, seconds: float, top: int) -> str:
+    total = sum(stacks.values()) or 1
+    leaves: Counter = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+
+    lines = [f"cpu profile: {samples} sample round(s) over {seconds:g}s, {len(stacks)} distinct stack(s)", ""]
+    lines.append(f"top {top} functions by samples:")
+    for label, count in leaves.most_common(top):
+        lines.append(f"{count:8d} {count * 100 / total:5.1f}%  {label}")
+    # folded stacks, the input format of flamegraph.pl and speedscope
+    lines.extend(["", f"top {top} stacks (folded):"])
+    for stack, count in stacks.most_common(top):
+        lines.append(f"{stack} {count}")
+    return "\n".join(lines) + "\n"
+
+
+async def profile_cpu(seconds: float, top: int = 20) -> str:
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    if _profile_lock.locked():
+        raise ProfilerBusyError("a profile is already running")
+    async with _profile_lock:
+        logger.info(f"cpu profiling for {seconds:g}s")
+        # the sampler runs in a worker thread so the event loop it is watching keeps running
+        stacks, samples = await asyncio.to_thread(sample_stacks, seconds)
+    return format_cpu_profile(stacks, samples, seconds, top)
+
+
+async def profile_memory(seconds: float, top: int = 20) -> str:
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    if _profile_lock.locked():
+        raise ProfilerBusyError("a profile is already running")
+    async with _profile_lock:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(25)
+        logger.info(f"tracing allocations for {seconds:g}s")
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+
+    lines = [
+        f"memory profile over {seconds:g}s: {current / 1024:.1f}kb traced now, {peak / 1024:.1f}kb peak",
+        "",
+        f"top {top} allocation sites by growth:",
+    ]
+    for stat in after.compare_to(before, "lineno")[:top]:
+        lines.append(f"{stat.size_diff / 1024:+10.1f}kb {stat.count_diff:+8d} blocks  {stat.traceback[0]}")
+    lines.extend(["", f"top {top} allocation sites by size:"])
+    for stat in after.statistics("traceback")[:top]:
+        lines.append(f"{stat.size / 1024:10.1f}kb {stat.count:8d} blocks")
+        lines.extend(f"    {frame}" for frame in stat.traceback.format(limit=5, most_recent_first=True))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,160 @@
+import re
+import time
+import asyncio
+
+from collections import Counter
+
+from nutalert.fetcher import fetch_server
+from nutalert.parser import parse_raw_values
+from nutalert.upsd import NutProtocolServer, format_var_list
+from nutalert.utils import setup_logger, load_config
+
+
+logger = setup_logger(__name__)
+
+
+DEFAULT_PROXY_CONFIG = {
+    "enabled": False,
+    "host": "127.0.0.1",
+    "port": 3493,
+    "max_staleness": 30,
+}
+
+UPS_NAME_PATTERN = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def get_proxy_config(config) -> dict:
+    return {**DEFAULT_PROXY_CONFIG, **(config.get("proxy") or {})}
+
+
+class CacheEntry:
+    __slots__ = ("device", "server", "timestamp", "values", "list_reply")
+
+    def __init__(self, device: str, server: dict):
+        self.device = device
+        self.server = server
+        self.timestamp = 0.0
+        self.values: dict[str, str] = {}
+        # the LIST VAR answer is built once per update, not once per downstream request
+        self.list_reply: bytes | None = None
+
+
+class PollCache:
+    def __init__(self):
+        self.entries: dict[str, CacheEntry] = {}
+        # downstream ups name -> cache entry
+        self.names: dict[str, CacheEntry] = {}
+        self.max_staleness = DEFAULT_PROXY_CONFIG["max_staleness"]
+        self._refreshes: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.refreshes = 0
+
+    def update(self, raw_by_device, servers, config, timestamp: float | None = None) -> None:
+        timestamp = time.time() if timestamp is None else timestamp
+        self.max_staleness = get_proxy_config(config)["max_staleness"]
+        servers_by_address = {f"{server['host']}:{server['port']}": server for server in servers}
+        changed = False
+        for device, raw in raw_by_device.items():
+            ups, _, address = device.rpartition("@")
+            if not raw or not ups or address not in servers_by_address:
+                continue
+            entry = self.entries.get(device)
+            if entry is None:
+                entry = self.entries[device] = CacheEntry(device, servers_by_address[address])
+                changed = True
+            # minimal_fetch polls only carry a few variables, they update the last full set
+            entry.values = {**entry.values, **parse_raw_values(raw)}
+            entry.server = servers_by_address[address]
+            entry.timestamp = timestamp
+            entry.list_reply = None
+        if changed:
+            self._rename()
+
+    def _rename(self) -> None:
+        # a ups keeps its own name unless another nut server has one with the same name
+        counts = Counter(device.rpartition("@")[0] for device in self.entries)
+        names = {}
+        for device, entry in sorted(self.entries.items()):
+            ups, _, address = device.rpartition("@")
+            name = ups if counts[ups] == 1 else f"{ups}-{address}"
+            names[UPS_NAME_PATTERN.sub("-", name)] = entry
+            entry.list_reply = None
+        self.names = names
+
+    def ups_list(self) -> dict[str, str]:
+        return {name: entry.values.get("device.description", "nutalert proxy") for name, entry in self.names.items()}
+
+    def ups_vars(self, name: str):
+        entry = self.names.get(name)
+        return None if entry is None else entry.values
+
+    def list_reply(self, name: str) -> bytes | None:
+        entry = self.names.get(name)
+        if entry is None:
+            return None
+        if entry.list_reply is None:
+            entry.list_reply = format_var_list(name, entry.values)
+        return entry.list_reply
+
+    async def ensure_fresh(self, name: str) -> bool:
+        entry = self.names.get(name)
+        if entry is None:
+            return True
+        if time.time() - entry.timestamp <= self.max_staleness:
+            self.hits += 1
+            return True
+
+        # every client asking for a stale server waits on the same upstream request
+        server = entry.server
+        address = f"{server['host']}:{server['port']}"
+        refresh = self._refreshes.get(address)
+        if refresh is None:
+            refresh = self._refreshes[address] = asyncio.create_task(self._refresh(server))
+            refresh.add_done_callback(lambda _: self._refreshes.pop(address, None))
+        await asyncio.shield(refresh)
+        return time.time() - entry.timestamp <= self.max_staleness
+
+    async def _refresh(self, server: dict) -> None:
+        self.refreshes += 1
+        raw_by_device = await fetch_server(server)
+        self.update(raw_by_device, [server], {"proxy": {"max_staleness": self.max_staleness}})
+
+
+proxy_cache = PollCache()
+
+
+class NutProxyServer(NutProtocolServer):
+    async def reply(self, words: list[str]) -> bytes | None:
+        command = [word.upper() for word in words[:2]]
+        if command in (["LIST", "VAR"], ["GET", "VAR"]) and len(words) >= 3:
+            if not await self.source.ensure_fresh(words[2]):
+                return b"ERR DATA-STALE\n"
+            if command == ["LIST", "VAR"] and len(words) == 3:
+                list_reply = self.source.list_reply(words[2])
+                return b"ERR UNKNOWN-UPS\n" if list_reply is None else list_reply
+        return await super().reply(words)
+
+
+class NutProxy:
+    def __init__(self):
+        self.server: NutProxyServer | None = None
+
+    async def start(self) -> None:
+        proxy_config = get_proxy_config(load_config() or {})
+        if not proxy_config["enabled"] or self.server is not None:
+            return
+        server = NutProxyServer(proxy_cache, proxy_config["host"], proxy_config["port"])
+        try:
+            await server.start()
+        except OSError as e:
+            logger.error(f"could not start the nut proxy on {proxy_config['host']}:{proxy_config['port']}: {e}")
+            return
+        self.server = server
+
+    async def close(self) -> None:
+        if self.server is not None:
+            await self.server.close()
+            self.server = None
+
+
+nut_proxy = NutProxy()
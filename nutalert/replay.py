@@ -0,0 +1,139 @@
+import time
+import signal
+import asyncio
+import argparse
+
+from array import array
+from bisect import bisect_right
+from collections import Counter
+
+from nutalert.trace import read_trace
+from nutalert.parser import parse_raw_values
+from nutalert.upsd import NutProtocolServer
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+class Timeline:
+    __slots__ = ("times", "values", "duration")
+
+    def __init__(self):
+        # seconds since the start of the trace, and the variables the device reported from then on
+        self.times = array("d")
+        self.values: list[dict[str, str]] = []
+        self.duration = 0.0
+
+    def add(self, offset: float, values: dict[str, str]) -> None:
+        # minimal_fetch polls only carry a few variables, they update the last full set instead of replacing it
+        if self.values:
+            values = {**self.values[-1], **values}
+        self.times.append(offset)
+        self.values.append(values)
+        self.duration = offset
+
+    def at(self, offset: float) -> dict[str, str]:
+        return self.values[max(0, bisect_right(self.times, offset) - 1)]
+
+
+def load_timelines(path: str) -> dict[str, Timeline]:
+    timelines: dict[str, Timeline] = {}
+    start = None
+    for timestamp, device, raw in read_trace(path):
+        values = parse_raw_values(raw)
+        if not values:
+            continue
+        start = timestamp if start is None else start
+        timelines.setdefault(device, Timeline()).add(timestamp - start, values)
+    return timelines
+
+
+class ReplaySource:
+    def __init__(
+        self,
+        traces: list[dict[str, Timeline]],
+        copies: int = 1,
+        speed: float = 1.0,
+        stagger: float = 0.0,
+        loop: bool = False,
+        clock=time.monotonic,
+    ):
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock
+        self.started_at = clock()
+
+        recorded = [(device, timeline) for timelines in traces for device, timeline in timelines.items()]
+        names = Counter(device.split("@", 1)[0] or "ups" for device, _ in recorded)
+        seen: Counter = Counter()
+        # virtual ups name -> (timeline, offset into it in trace seconds)
+        self.devices: dict[str, tuple[Timeline, float]] = {}
+        for device, timeline in recorded:
+            name = device.split("@", 1)[0] or "ups"
+            if names[name] > 1:
+                seen[name] += 1
+                name = f"{name}-{seen[name]}"
+            for copy in range(copies):
+                virtual = f"{name}-{copy:03d}" if copies > 1 else name
+                # copies share the recorded values, only their position in the trace differs
+                self.devices[virtual] = (timeline, copy * stagger)
+
+    def position(self, offset: float, timeline: Timeline) -> float:
+        position = (self.clock() - self.started_at) * self.speed + offset
+        if self.loop and timeline.duration > 0:
+            position %= timeline.duration
+        return position
+
+    def ups_list(self) -> dict[str, str]:
+        return {name: "nutalert replay" for name in self.devices}
+
+    def ups_vars(self, name: str):
+        entry = self.devices.get(name)
+        if entry is None:
+            return None
+        timeline, offset = entry
+        return timeline.at(self.position(offset, timeline))
+
+
+async def serve(source: ReplaySource, host: str, port: int) -> None:
+    server = NutProtocolServer(source, host, port)
+    await server.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m nutalert.replay", description="serve recorded nut traces")
+    parser.add_argument("traces", nargs="+", help="trace files written by the recording option")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=3493, help="port to listen on (default: 3493)")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 60 plays an hour in a minute")
+    parser.add_argument("--copies", type=int, default=1, help="virtual devices served per recorded device")
+    parser.add_argument("--stagger", type=float, default=0.0, help="trace seconds between consecutive copies")
+    parser.add_argument("--loop", action="store_true", help="start over at the end of each trace")
+    args = parser.parse_args(argv)
+
+    traces = []
+    for path in args.traces:
+        timelines = load_timelines(path)
+        samples = sum(len(timeline.times) for timeline in timelines.values())
+        duration = max((timeline.duration for timeline in timelines.values()), default=0.0)
+        logger.info(f"loaded '{path}': {len(timelines)} device(s), {samples} sample(s) over {duration:.0f}s")
+        traces.append(timelines)
+
+    source = ReplaySource(traces, args.copies, args.speed, args.stagger, args.loop)
+    if not source.devices:
+        parser.error("the traces do not contain any ups data")
+    logger.info(f"replaying {len(source.devices)} virtual device(s) at {args.speed:g}x")
+    asyncio.run(serve(source, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import time
+import random
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+DEFAULT_IDLE_INTERVAL = 15
+
+DEFAULT_POLLING_CONFIG = {
+    "fast_interval": 5,
+    "slow_interval": 60,
+    "stable_polls": 10,
+    "jitter": 0.1,
+}
+
+
+def get_polling_config(config) -> dict:
+    polling_config = {**DEFAULT_POLLING_CONFIG, **(config.get("polling") or {})}
+    polling_config["interval"] = config.get("check_interval", 15)
+    return polling_config
+
+
+def server_address(server) -> str:
+    return f"{server['host']}:{server['port']}"
+
+
+class DeviceCadence:
+    __slots__ = ("signature", "charge", "stable", "interval")
+
+    def __init__(self, interval: float):
+        self.signature = None
+        self.charge: float | None = None
+        self.stable = 0
+        self.interval = interval
+
+    def update(self, snapshot, polling_config) -> float:
+        nut_values = snapshot["nut_values"]
+        status = str(nut_values.get("ups.status", "")).lower()
+        charge = nut_values.get("battery.charge")
+        discharging = isinstance(charge, (int, float)) and self.charge is not None and charge < self.charge
+        self.charge = charge if isinstance(charge, (int, float)) else None
+
+        signature = (status, snapshot["is_alerting"], tuple(snapshot["alert_rules"]))
+        self.stable = self.stable + 1 if signature == self.signature else 0
+        self.signature = signature
+
+        if snapshot["stale"] or not nut_values:
+            # unreachable servers are paced by their circuit breaker, keep the regular cadence
+            self.interval = polling_config["interval"]
+        elif not status.startswith("ol") or discharging:
+            self.interval = polling_config["fast_interval"]
+        elif self.stable >= polling_config["stable_polls"]:
+            self.interval = polling_config["slow_interval"]
+        else:
+            self.interval = polling_config["interval"]
+        return self.interval
+
+
+class PollScheduler:
+    def __init__(self):
+        self.devices: dict[str, DeviceCadence] = {}
+        # address -> (deadline without jitter, jittered wake up time)
+        self.deadlines: dict[str, tuple[float, float]] = {}
+        self.intervals: dict[str, float] = {}
+        self.idle_interval = DEFAULT_IDLE_INTERVAL
+        # set while the configuration has nothing that can be polled
+        self.retry_at: float | None = None
+
+    def due(self, servers, now: float | None = None) -> list:
+        now = time.monotonic() if now is None else now
+        addresses = {server_address(server) for server in servers}
+        for address in self.deadlines.keys() - addresses:
+            del self.deadlines[address]
+            self.intervals.pop(address, None)
+
+        due = [server for server in servers if self.deadlines.get(server_address(server), (0.0, 0.0))[1] <= now]
+        if not due and servers:
+            # woken up slightly early, take the next server instead of spinning
+            due = [min(servers, key=lambda server: self.deadlines[server_address(server)][1])]
+        return due
+
+    def update(self, polled_servers, snapshots, config, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        polling_config = get_polling_config(config)
+        self.idle_interval = polling_config["interval"]
+        self.retry_at = None
+
+        intervals: dict[str, float] = {}
+        for device, snapshot in snapshots.items():
+            cadence = self.devices.get(device)
+            if cadence is None:
+                cadence = self.devices[device] = DeviceCadence(polling_config["interval"])
+            address = device.rsplit("@", 1)[-1]
+            interval = cadence.update(snapshot, polling_config)
+            intervals[address] = min(interval, intervals.get(address, interval))
+
+        for server in polled_servers:
+            address = server_address(server)
+            interval = intervals.get(address, polling_config["interval"])
+            if interval != self.intervals.get(address, polling_config["interval"]):
+                logger.info(f"polling {address} every {interval}s")
+            self.intervals[address] = interval
+
+            # deadlines advance on a fixed grid so the period does not drift by the fetch time
+            deadline = self.deadlines.get(address, (now, now))[0] + interval
+            if deadline <= now:
+                deadline = now + interval
+            jitter = random.uniform(-1, 1) * polling_config["jitter"] * interval
+            self.deadlines[address] = (deadline, max(now, deadline + jitter))
+
+    def retry_later(self, config, now: float | None = None) -> None:
+        # a missing or unreadable configuration is checked again after one regular interval, not in a busy loop
+        now = time.monotonic() if now is None else now
+        if config:
+            self.idle_interval = get_polling_config(config)["interval"]
+        self.retry_at = now + self.idle_interval
+
+    def time_until_next(self, now: float | None = None) -> float:
+        now = time.monotonic() if now is None else now
+        wake_at = min((wake_at for _, wake_at in self.deadlines.values()), default=now + self.idle_interval)
+        if self.retry_at is not None:
+            wake_at = max(wake_at, self.retry_at)
+        return max(0.0, wake_at - now)
+
+
+poll_scheduler = PollScheduler()
@@ -0,0 +1,95 @@
+import os
+import time
+import signal
+import asyncio
+import argparse
+import resource
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+# time from main() to the first completed poll, including the lazy imports of the pipeline
+COLD_START_BUDGET_MS = 500
+
+
+def _report_cold_start(started_at: float) -> None:
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    message = f"first poll finished {elapsed_ms:.0f}ms after start, peak rss {rss_mb:.1f}mb"
+    if elapsed_ms > COLD_START_BUDGET_MS:
+        logger.warning(f"{message}, over the {COLD_START_BUDGET_MS}ms cold start budget")
+    else:
+        logger.info(message, extra={"stage": "startup", "duration": round(elapsed_ms, 1)})
+
+
+async def run_poller(started_at: float, once: bool = False) -> None:
+    # the processor pulls in the fetch, alert and notify pipeline but none of the ui modules
+    from nutalert.processor import get_ups_data_and_alerts
+    from nutalert.scheduler import poll_scheduler
+    from nutalert.fetcher import async_connection_pool
+    from nutalert.notifier import notification_dispatcher
+    from nutalert.storage import close_history_store
+    from nutalert.trace import trace_recorder
+    from nutalert.proxy import nut_proxy
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    first_poll = True
+    await nut_proxy.start()
+    try:
+        while not stop.is_set():
+            try:
+                await get_ups_data_and_alerts()
+            except Exception as e:
+                logger.error(f"error in polling loop: {e}")
+            if first_poll:
+                _report_cold_start(started_at)
+                first_poll = False
+            if once:
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), poll_scheduler.time_until_next())
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        logger.info("shutting down nutalert")
+        await nut_proxy.close()
+        await notification_dispatcher.close()
+        await async_connection_pool.close_all()
+        close_history_store()
+        trace_recorder.close()
+
+
+def run_dashboard() -> None:
+    from nicegui import ui
+
+    import nutalert.dashboard  # noqa: F401  registers the page and the polling task
+
+    ui.run(title="nutalert", port=8087, favicon="assets/logo.ico", reload=False)
+
+
+def main(argv: list[str] | None = None) -> None:
+    started_at = time.perf_counter()
+    parser = argparse.ArgumentParser(prog="nutalert", description="nutalert ups monitoring and alert system")
+    parser.add_argument("-c", "--config", help="path to config.yaml (defaults to $CONFIG_PATH)")
+    parser.add_argument("--ui", action="store_true", help="run the web dashboard on port 8087 instead")
+    parser.add_argument("--once", action="store_true", help="poll every nut server once and exit")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        os.environ["CONFIG_PATH"] = args.config
+
+    if args.ui:
+        run_dashboard()
+        return
+    asyncio.run(run_poller(started_at, once=args.once))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import os
+import csv
+import time
+import queue
+import asyncio
+import sqlite3
+import threading
+
+from io import StringIO
+from contextlib import contextmanager
+
+from nutalert.utils import setup_logger, get_config_path
+
+
+logger = setup_logger(__name__)
+
+
+HOUR = 3600
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    device TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    ts REAL NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_device_metric_ts ON samples (device, metric, ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    device TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    mean REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (resolution, device, metric, ts)
+) WITHOUT ROWID;
+"""
+
+HOURLY_ROLLUP = """
+INSERT OR REPLACE INTO rollups
+SELECT ?, device, metric, CAST(ts / ? AS INTEGER) * ?, MIN(value), MAX(value), AVG(value), COUNT(*)
+FROM samples WHERE ts >= ? AND ts < ?
+GROUP BY device, metric, CAST(ts / ? AS INTEGER)
+"""
+
+DAILY_ROLLUP = """
+INSERT OR REPLACE INTO rollups
+SELECT ?, device, metric, CAST(ts / ? AS INTEGER) * ?, MIN(min), MAX(max), SUM(mean * count) / SUM(count), SUM(count)
+FROM rollups WHERE resolution = ? AND ts >= ? AND ts < ?
+GROUP BY device, metric, CAST(ts / ? AS INTEGER)
+"""
+
+DEFAULT_STORAGE_CONFIG = {
+    "enabled": False,
+    "path": None,
+    "flush_interval": 10,
+    "batch_size": 1000,
+    "max_queue": 100000,
+    "raw_retention_days": 7,
+    "hourly_retention_days": 90,
+    "daily_retention_days": 730,
+}
+
+
+def get_storage_config(config) -> dict:
+    storage_config = {**DEFAULT_STORAGE_CONFIG, **(config.get("storage") or {})}
+    if not storage_config["path"]:
+        storage_config["path"] = os.path.join(os.path.dirname(os.path.abspath(get_config_path())), "nutalert.db")
+    return storage_config
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+@contextmanager
+def reader(path: str):
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+class HistoryStore:
+    def __init__(self, storage_config: dict):
+        self.config = storage_config
+        self.path = storage_config["path"]
+        self._queue: queue.Queue = queue.Queue(maxsize=storage_config["max_queue"])
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.dropped = 0
+
+    def start(self) -> None:
+        connection = connect(self.path)
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+        self._thread = threading.Thread(target=self._run, name="nutalert-history-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"history store writing to '{self.path}'")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        # wake the writer if it is waiting on an empty queue
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join()
+        self._thread = None
+
+    def add(self, device: str, nut_values, metrics, timestamp: float) -> None:
+        for metric in metrics:
+            value = nut_values.get(metric)
+            if not isinstance(value, (int, float)):
+                continue
+            try:
+                self._queue.put_nowait((device, metric, timestamp, float(value)))
+            except queue.Full:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning(f"history store queue is full, {self.dropped} sample(s) dropped so far")
+                return
+
+    def add_fleet(self, snapshots, metrics) -> None:
+        for device, snapshot in snapshots.items():
+            if snapshot["nut_values"]:
+                self.add(device, snapshot["nut_values"], metrics, snapshot["timestamp"])
+
+    def _drain(self, timeout: float) -> list[tuple]:
+        rows = []
+        try:
+            rows.append(self._queue.get(timeout=timeout))
+            while len(rows) < self.config["batch_size"]:
+                rows.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return [row for row in rows if row is not None]
+
+    def _flush(self, connection: sqlite3.Connection, rows: list[tuple]) -> None:
+        try:
+            with connection:
+                connection.executemany("INSERT INTO samples VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logger.error(f"failed to write {len(rows)} history sample(s): {e}")
+
+    def _run(self) -> None:
+        connection = connect(self.path)
+        pending: list[tuple] = []
+        last_flush = time.monotonic()
+        last_maintenance = 0.0
+        try:
+            while not self._stop.is_set():
+                pending.extend(self._drain(timeout=1.0))
+                now = time.monotonic()
+                if pending and (
+                    len(pending) >= self.config["batch_size"] or now - last_flush >= self.config["flush_interval"]
+                ):
+                    self._flush(connection, pending)
+                    pending, last_flush = [], now
+                if now - last_maintenance >= HOUR:
+                    self._maintain(connection)
+                    last_maintenance = now
+            pending.extend(self._drain(timeout=0))
+            while not self._queue.empty():
+                pending.extend(self._drain(timeout=0))
+            if pending:
+                self._flush(connection, pending)
+        finally:
+            connection.close()
+
+    def _rollup_watermark(self, connection: sqlite3.Connection, resolution: int, source_sql: str) -> float | None:
+        (last,) = connection.execute("SELECT MAX(ts) FROM rollups WHERE resolution = ?", (resolution,)).fetchone()
+        if last is not None:
+            # re-aggregate the newest bucket, it may have been rolled up while still filling
+            return last
+        (first,) = connection.execute(source_sql).fetchone()
+        return None if first is None else int(first // resolution) * resolution
+
+    def _maintain(self, connection: sqlite3.Connection) -> None:
+        now = time.time()
+        try:
+            with connection:
+                start = self._rollup_watermark(connection, HOUR, "SELECT MIN(ts) FROM samples")
+                if start is not None:
+                    connection.execute(HOURLY_ROLLUP, (HOUR, HOUR, HOUR, start, now, HOUR))
+                start = self._rollup_watermark(
+                    connection, DAY, f"SELECT MIN(ts) FROM rollups WHERE resolution = {HOUR}"
+                )
+                if start is not None:
+                    connection.execute(DAILY_ROLLUP, (DAY, DAY, DAY, HOUR, start, now, DAY))
+
+                connection.execute("DELETE FROM samples WHERE ts < ?", (now - self.config["raw_retention_days"] * DAY,))
+                connection.execute(
+                    "DELETE FROM rollups WHERE resolution = ? AND ts < ?",
+                    (HOUR, now - self.config["hourly_retention_days"] * DAY),
+                )
+                connection.execute(
+                    "DELETE FROM rollups WHERE resolution = ? AND ts < ?",
+                    (DAY, now - self.config["daily_retention_days"] * DAY),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"history store maintenance failed: {e}")
+
+    def pick_resolution(self, start: float) -> int:
+        age = time.time() - start
+        if age <= self.config["raw_retention_days"] * DAY:
+            return 0
+        if age <= self.config["hourly_retention_days"] * DAY:
+            return HOUR
+        return DAY
+
+    def query(
+        self, device: str, metric: str, start: float, end: float | None = None, resolution: int | None = None
+    ) -> list[tuple[float, float, float, float]]:
+        end = time.time() if end is None else end
+        resolution = self.pick_resolution(start) if resolution is None else resolution
+        with reader(self.path) as connection:
+            if resolution == 0:
+                rows = connection.execute(
+                    "SELECT ts, value, value, value FROM samples"
+                    " WHERE device = ? AND metric = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (device, metric, start, end),
+                )
+            else:
+                rows = connection.execute(
+                    "SELECT ts, min, max, mean FROM rollups"
+                    " WHERE resolution = ? AND device = ? AND metric = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (resolution, device, metric, start, end),
+                )
+            return rows.fetchall()
+
+    def devices(self) -> list[str]:
+        with reader(self.path) as connection:
+            rows = connection.execute("SELECT DISTINCT device FROM rollups UNION SELECT DISTINCT device FROM samples")
+            return sorted(device for (device,) in rows)
+
+    def export_csv(self, device: str, metrics, start: float, end: float | None = None) -> str:
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["device", "metric", "timestamp", "min", "max", "mean"])
+        for metric in metrics:
+            for row in self.query(device, metric, start, end):
+                writer.writerow([device, metric, *row])
+        return output.getvalue()
+
+
+history_store: HistoryStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_history_store(config) -> HistoryStore | None:
+    global history_store
+    storage_config = get_storage_config(config)
+    with _store_lock:
+        if history_store is not None and (
+            not storage_config["enabled"] or storage_config["path"] != history_store.path
+        ):
+            history_store.stop()
+            history_store = None
+        if storage_config["enabled"] and history_store is None:
+            try:
+                history_store = HistoryStore(storage_config)
+                history_store.start()
+            except sqlite3.Error as e:
+                logger.error(f"could not open history store at '{storage_config['path']}': {e}")
+                history_store = None
+        elif history_store is not None:
+            history_store.config = storage_config
+        return history_store
+
+
+async def get_history_store_async(config) -> HistoryStore | None:
+    storage_config = get_storage_config(config)
+    current = history_store
+    if current is None and not storage_config["enabled"]:
+        return None
+    if current is not None and storage_config["enabled"] and storage_config["path"] == current.path:
+        current.config = storage_config
+        return current
+    # opening the database or joining the old writer thread would stall the event loop serving the dashboard
+    return await asyncio.to_thread(get_history_store, config)
+
+
+def close_history_store() -> None:
+    global history_store
+    with _store_lock:
+        if history_store is not None:
+            history_store.stop()
+            history_store = None
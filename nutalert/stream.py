@@ -0,0 +1,121 @@
+import json
+import math
+import time
+import asyncio
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+SUBSCRIBER_QUEUE_SIZE = 32
+KEEPALIVE_INTERVAL = 15
+
+
+def compact_snapshot(snapshot) -> dict:
+    # json has no infinity, a forecast without a drain simply has no time_to_empty value
+    values = {
+        key: value
+        for key, value in snapshot["nut_values"].items()
+        if not (isinstance(value, float) and not math.isfinite(value))
+    }
+    return {
+        "timestamp": snapshot["timestamp"],
+        "alerting": snapshot["is_alerting"],
+        "message": snapshot["alert_message"],
+        "rules": {rule: list(result) for rule, result in snapshot["alert_rules"].items()},
+        "stale": snapshot["stale"],
+        "age": snapshot["age"],
+        "values": values,
+    }
+
+
+def merge_patch(old: dict, new: dict) -> dict:
+    # json merge patch (rfc 7396): changed keys carry their new value, removed keys are null
+    patch = {key: None for key in old.keys() - new.keys()}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = merge_patch(previous, value)
+            if nested:
+                patch[key] = nested
+        elif key not in old or previous != value:
+            patch[key] = value
+    return patch
+
+
+class StreamMessage:
+    __slots__ = ("seq", "event", "text", "sse")
+
+    def __init__(self, seq: int, event: str, devices: dict):
+        self.seq = seq
+        self.event = event
+        # serialized once, every subscriber gets the same bytes
+        self.text = json.dumps({"type": event, "seq": seq, "devices": devices}, separators=(",", ":"))
+        self.sse = f"id: {seq}\nevent: {event}\ndata: {self.text}\n\n".encode()
+
+
+class Subscriber:
+    __slots__ = ("queue", "dropped")
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+
+class SnapshotStream:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.devices: dict[str, dict] = {}
+        self.subscribers: set[Subscriber] = set()
+        self.seq = 0
+        self.published_at = 0.0
+        self._snapshot_message: StreamMessage | None = None
+
+    def snapshot_message(self) -> StreamMessage:
+        if self._snapshot_message is None or self._snapshot_message.seq != self.seq:
+            self._snapshot_message = StreamMessage(self.seq, "snapshot", self.devices)
+        return self._snapshot_message
+
+    def publish(self, snapshots) -> None:
+        # a device missing from a server that did answer was removed, unreachable ones keep their last state
+        polled_addresses = {device.rsplit("@", 1)[-1] for device in snapshots}
+        updated = {
+            device: state
+            for device, state in self.devices.items()
+            if device in snapshots or device.rsplit("@", 1)[-1] not in polled_addresses
+        }
+        updated.update((device, compact_snapshot(snapshot)) for device, snapshot in snapshots.items())
+        patch = merge_patch(self.devices, updated) if self.subscribers else None
+        self.devices = updated
+        self.seq += 1
+        self.published_at = time.time()
+        if not self.subscribers or not patch:
+            return
+
+        message = StreamMessage(self.seq, "delta", patch)
+        for subscriber in self.subscribers:
+            if subscriber.queue.full():
+                # a subscriber that fell behind gets one full snapshot in place of the deltas it could not take
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                    subscriber.dropped += 1
+                subscriber.queue.put_nowait(self.snapshot_message())
+                logger.warning(f"stream subscriber is falling behind, {subscriber.dropped} message(s) dropped so far")
+            else:
+                subscriber.queue.put_nowait(message)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        subscriber.queue.put_nowait(self.snapshot_message())
+        self.subscribers.add(subscriber)
+        logger.info(f"stream subscriber connected, {len(self.subscribers)} active")
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+        logger.info(f"stream subscriber disconnected, {len(self.subscribers)} active")
+
+
+snapshot_stream = SnapshotStream()
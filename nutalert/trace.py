@@ -0,0 +1,120 @@
+import gzip
+import struct
+import threading
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+# a trace is a gzip stream of records, each one a kind byte followed by a fixed header and its payload:
+#   H: version (u16), written whenever a recorder opens the file, appends start a new gzip member
+#   R: timestamp (f64), device id length (u16), reply length (u32), device id, raw upsd reply
+TRACE_VERSION = 1
+HEADER_RECORD = struct.Struct("<H")
+REPLY_RECORD = struct.Struct("<dHI")
+
+
+class TraceFormatError(ValueError):
+    pass
+
+
+class TraceWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = gzip.open(path, "ab")
+        self.file.write(b"H" + HEADER_RECORD.pack(TRACE_VERSION))
+        self.records = 0
+
+    def write(self, timestamp: float, device: str, raw: str) -> None:
+        device_bytes, raw_bytes = device.encode(), raw.encode()
+        self.file.write(b"R" + REPLY_RECORD.pack(timestamp, len(device_bytes), len(raw_bytes)))
+        self.file.write(device_bytes)
+        self.file.write(raw_bytes)
+        self.records += 1
+
+    def flush(self) -> None:
+        # a sync flush keeps what was written readable if the process dies, at a small cost in ratio
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _read_exactly(file, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise EOFError("trace ends in the middle of a record")
+    return data
+
+
+def read_trace(path: str):
+    with gzip.open(path, "rb") as file:
+        try:
+            while kind := file.read(1):
+                if kind == b"H":
+                    (version,) = HEADER_RECORD.unpack(_read_exactly(file, HEADER_RECORD.size))
+                    if version != TRACE_VERSION:
+                        raise TraceFormatError(f"unsupported trace version {version}")
+                elif kind == b"R":
+                    timestamp, device_length, raw_length = REPLY_RECORD.unpack(_read_exactly(file, REPLY_RECORD.size))
+                    device = _read_exactly(file, device_length).decode()
+                    raw = _read_exactly(file, raw_length).decode("utf-8", errors="replace")
+                    yield timestamp, device, raw
+                else:
+                    raise TraceFormatError(f"unknown record kind {kind!r}")
+        except (EOFError, gzip.BadGzipFile) as e:
+            # the tail of a trace whose recorder was killed, everything before it is still good
+            logger.warning(f"trace '{path}' is truncated: {e}")
+
+
+class TraceRecorder:
+    def __init__(self):
+        self.writer: TraceWriter | None = None
+        self._lock = threading.Lock()
+
+    def configure(self, config) -> None:
+        recording_config = config.get("recording") or {}
+        path = recording_config.get("path") if recording_config.get("enabled", False) else None
+        with self._lock:
+            if self.writer is not None and self.writer.path == path:
+                return
+            if self.writer is not None:
+                logger.info(f"stopped recording to '{self.writer.path}' after {self.writer.records} reply(s)")
+                self.writer.close()
+                self.writer = None
+            if path:
+                try:
+                    self.writer = TraceWriter(path)
+                    logger.info(f"recording nut replies to '{path}'")
+                except OSError as e:
+                    logger.error(f"could not open trace file '{path}': {e}")
+
+    def record(self, raw_by_device, timestamp: float) -> None:
+        if self.writer is None:
+            return
+        with self._lock:
+            if self.writer is None:
+                return
+            try:
+                for device, raw in raw_by_device.items():
+                    if raw:
+                        self.writer.write(timestamp, device, raw)
+                self.writer.flush()
+            except OSError as e:
+                logger.error(f"failed to write to trace file '{self.writer.path}', recording stopped: {e}")
+                writer, self.writer = self.writer, None
+                try:
+                    writer.close()
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        with self._lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+
+trace_recorder = TraceRecorder()
@@ -0,0 +1,85 @@
+import time
+import inspect
+import functools
+
+
+# imported by nutalert.utils, so this module must not import anything from nutalert itself
+
+
+class SpanStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Tracer:
+    def __init__(self):
+        # checked on every traced call, a disabled span costs one attribute lookup
+        self.enabled = False
+        self.spans: dict[str, SpanStats] = {}
+
+    def configure(self, config) -> None:
+        self.enabled = bool((config.get("profiling") or {}).get("spans", False))
+
+    def record(self, name: str, seconds: float) -> None:
+        stats = self.spans.get(name)
+        if stats is None:
+            stats = self.spans[name] = SpanStats()
+        stats.add(seconds)
+
+    def stats(self) -> dict:
+        return {name: stats.to_dict() for name, stats in sorted(self.spans.items())}
+
+    def reset(self) -> None:
+        self.spans = {}
+
+
+tracer = Tracer()
+
+
+def traced(name: str):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    tracer.record(name, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
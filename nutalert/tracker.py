@@ -0,0 +1,140 @@
+import time
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+OK = "ok"
+PENDING = "pending"
+FIRING = "firing"
+RESOLVED = "resolved"
+
+DEFAULT_ALERT_POLICY = {
+    "fire_after": 1,
+    "resolve_after": 1,
+    "coalesce_window": 0,
+    "notify_resolved": False,
+}
+
+
+def get_alert_policy(config) -> dict:
+    policy = {**DEFAULT_ALERT_POLICY, **(config.get("alert_policy") or {})}
+    policy["cooldown"] = (config.get("notifications") or {}).get("cooldown", 60)
+    status_alert = (config.get("basic_alerts") or {}).get("ups_status") or {}
+    policy["status_changes_only"] = status_alert.get("alert_when_status_changed", False)
+    return policy
+
+
+class AlertState:
+    __slots__ = ("state", "count", "since", "notified_at", "message")
+
+    def __init__(self, now: float):
+        self.state = OK
+        self.count = 0
+        self.since = now
+        self.notified_at = 0.0
+        self.message = ""
+
+    def enter(self, state: str, now: float) -> None:
+        self.state = state
+        self.count = 0
+        self.since = now
+
+
+class AlertTracker:
+    def __init__(self):
+        # device -> rule name -> state, rules that are ok are not kept
+        self.states: dict[str, dict[str, AlertState]] = {}
+        self._events: list[tuple[str, str, str, str]] = []
+        self._window_start: float | None = None
+
+    def _step(self, device: str, states, rule: str, result, policy, now: float) -> tuple[str, str, str, str] | None:
+        alert = states.get(rule)
+        if alert is None:
+            if result is None or not result[0]:
+                return None
+            alert = states[rule] = AlertState(now)
+
+        # a firing alert only clears once the value leaves the hysteresis band, anything else needs a real breach
+        active = result is not None and (alert.state == FIRING or result[0])
+        message = result[1] if result is not None else alert.message
+
+        if alert.state in (OK, RESOLVED):
+            if not active:
+                del states[rule]
+                return None
+            alert.enter(PENDING, now)
+
+        if alert.state == PENDING:
+            if not active:
+                del states[rule]
+                return None
+            alert.count += 1
+            alert.message = message
+            if alert.count < policy["fire_after"]:
+                return None
+            alert.enter(FIRING, now)
+            alert.notified_at = now
+            return FIRING, device, rule, message
+
+        # firing
+        if active:
+            alert.count = 0
+            # inside the hysteresis band the message no longer describes a breach, keep the last one
+            changed = result[0] and message != alert.message
+            if result[0]:
+                alert.message = message
+            if rule == "ups_status" and policy["status_changes_only"]:
+                repeat = changed
+            else:
+                repeat = policy["cooldown"] > 0 and now - alert.notified_at >= policy["cooldown"]
+            if repeat:
+                alert.notified_at = now
+                return FIRING, device, rule, message
+            return None
+
+        alert.count += 1
+        if alert.count < policy["resolve_after"]:
+            return None
+        alert.enter(RESOLVED, now)
+        return RESOLVED, device, rule, alert.message
+
+    def update(self, rules_by_device, policy, now: float | None = None) -> list[tuple[str, str, str, str]]:
+        now = time.time() if now is None else now
+        events = []
+        for device, rules in rules_by_device.items():
+            states = self.states.setdefault(device, {})
+            for rule in [*rules, *(rule for rule in states if rule not in rules)]:
+                event = self._step(device, states, rule, rules.get(rule), policy, now)
+                if event is not None:
+                    logger.info(f"{rule} alert for {device} is {event[0]}", extra={"device": device, "stage": "alert"})
+                    events.append(event)
+            if not states:
+                del self.states[device]
+
+        if events and self._window_start is None:
+            self._window_start = now
+        self._events.extend(events)
+        if self._window_start is None or now - self._window_start < policy["coalesce_window"]:
+            return []
+        # everything that changed within the window goes out together, with the latest event per alert
+        latest = {(device, rule): (kind, device, rule, message) for kind, device, rule, message in self._events}
+        self._events, self._window_start = [], None
+        return [event for event in latest.values() if policy["notify_resolved"] or event[0] != RESOLVED]
+
+    def get_states(self, device: str) -> dict[str, str]:
+        return {rule: alert.state for rule, alert in self.states.get(device, {}).items()}
+
+
+def format_notification(events, single_device: bool) -> tuple[str, str]:
+    lines = []
+    for kind, device, rule, message in events:
+        text = message if kind == FIRING else f"resolved: {message}"
+        lines.append(text if single_device else f"{device}: {text}")
+    title = "UPS Alert" if any(kind == FIRING for kind, *_ in events) else "UPS Recovered"
+    return title, "\n".join(lines)
+
+
+alert_tracker = AlertTracker()
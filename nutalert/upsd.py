@@ -0,0 +1,113 @@
+import shlex
+import asyncio
+
+from nutalert.utils import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+VERSION_REPLY = b"Network UPS Tools upsd 2.8.0 - nutalert\n"
+NETVER_REPLY = b"1.3\n"
+MAX_LINE_LENGTH = 4096
+
+
+def quote(value) -> str:
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def format_ups_list(devices) -> bytes:
+    lines = ["BEGIN LIST UPS", *(f"UPS {name} {quote(description)}" for name, description in devices.items())]
+    lines.append("END LIST UPS")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def format_var_list(name: str, variables) -> bytes:
+    lines = [f"BEGIN LIST VAR {name}", *(f"VAR {name} {key} {quote(value)}" for key, value in variables.items())]
+    lines.append(f"END LIST VAR {name}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+# a read-only subset of the upsd network protocol, answered from a source that provides
+# ups_list() -> {name: description} and ups_vars(name) -> {variable: value} or None
+class NutProtocolServer:
+    def __init__(self, source, host: str = "127.0.0.1", port: int = 3493):
+        self.source = source
+        self.host = host
+        self.port = port
+        self.server: asyncio.Server | None = None
+        # writers of the connected sessions, closed along with the listener
+        self.clients: set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port, limit=MAX_LINE_LENGTH)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"serving the nut protocol on {self.host}:{self.port}")
+        return self.port
+
+    async def close(self) -> None:
+        if self.server is None:
+            return
+        self.server.close()
+        for writer in list(self.clients):
+            writer.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    async def reply(self, words: list[str]) -> bytes | None:
+        command = [word.upper() for word in words[:2]]
+        if command == ["LIST", "UPS"]:
+            return format_ups_list(self.source.ups_list())
+        if command == ["LIST", "VAR"] and len(words) == 3:
+            variables = self.source.ups_vars(words[2])
+            return b"ERR UNKNOWN-UPS\n" if variables is None else format_var_list(words[2], variables)
+        if command == ["GET", "VAR"] and len(words) == 4:
+            variables = self.source.ups_vars(words[2])
+            if variables is None:
+                return b"ERR UNKNOWN-UPS\n"
+            if words[3] not in variables:
+                return b"ERR VAR-NOT-SUPPORTED\n"
+            return f"VAR {words[2]} {words[3]} {quote(variables[words[3]])}\n".encode()
+        if command[:1] == ["VER"]:
+            return VERSION_REPLY
+        if command[:1] == ["NETVER"]:
+            return NETVER_REPLY
+        if command[:1] in (["USERNAME"], ["PASSWORD"], ["LOGIN"]):
+            # nothing here needs a login, but clients that always send one should not fail
+            return b"OK\n"
+        if command[:1] in (["LIST"], ["GET"]):
+            return b"ERR INVALID-ARGUMENT\n"
+        return b"ERR UNKNOWN-COMMAND\n"
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    writer.write(b"ERR INVALID-ARGUMENT\n")
+                    break
+                if not line:
+                    break
+                try:
+                    words = shlex.split(line.decode("utf-8", errors="replace"))
+                except ValueError:
+                    writer.write(b"ERR INVALID-ARGUMENT\n")
+                    continue
+                if not words:
+                    continue
+                if words[0].upper() == "LOGOUT":
+                    writer.write(b"OK Goodbye\n")
+                    break
+                response = await self.reply(words)
+                if response is None:
+                    # a reply of None drops the connection, like a crashing upsd would
+                    break
+                writer.write(response)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
@@ -1,43 +1,155 @@
 import os
 import sys
 import yaml
+import copy
+import atexit
+import queue
 import logging
+import threading
+import logging.handlers
 
+from types import MappingProxyType
+from itertools import islice
 from collections import deque
+from collections.abc import Mapping
 
+from nutalert.tracing import traced
 
-LOG_BUFFER: deque[str] = deque(maxlen=100)
 
+DEFAULT_LOG_BUFFER_SIZE = 1000
 
-class LogBufferIO:
-    def write(self, message: str) -> None:
-        if message.strip():
-            LOG_BUFFER.append(message.strip())
 
-    def flush(self) -> None:
-        pass
+class LogBuffer:
+    def __init__(self, maxlen: int = DEFAULT_LOG_BUFFER_SIZE):
+        self._lines: deque[str] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        # sequence number the next line will get, the oldest buffered line is next_seq - len(_lines)
+        self.next_seq = 0
+
+    def append(self, line: str) -> None:
+        with self._lock:
+            self._lines.append(line)
+            self.next_seq += 1
+
+    def resize(self, maxlen: int) -> None:
+        if maxlen == self._lines.maxlen:
+            return
+        with self._lock:
+            self._lines = deque(self._lines, maxlen=maxlen)
+
+    def since(self, cursor: int) -> tuple[list[str], int]:
+        with self._lock:
+            count = min(self.next_seq - cursor, len(self._lines))
+            if count <= 0:
+                return [], self.next_seq
+            # walk from the newest end so the cost follows the number of new lines, not the buffer size
+            lines = list(islice(reversed(self._lines), count))
+            return lines[::-1], self.next_seq
+
+
+LOG_BUFFER = LogBuffer()
+
+
+LOG_FORMAT = "%(asctime)s - [%(levelname)s] - %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# optional fields passed through `extra=`, appended to the line so logs can be filtered on them
+LOG_FIELDS = ("device", "stage", "duration")
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = [f"{field}={getattr(record, field)}" for field in LOG_FIELDS if hasattr(record, field)]
+        return f"{line} [{' '.join(fields)}]" if fields else line
+
+
+EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message is merged here, before mutable args can change and without anything unpicklable in the queue,
+        # the line itself is still formatted once on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogFanoutHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(StructuredFormatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+        self.file_handler: logging.handlers.RotatingFileHandler | None = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = self.format(record)
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+            LOG_BUFFER.append(line)
+            if self.file_handler is not None:
+                stream = self.file_handler.stream
+                stream.write(line + "\n")
+                stream.flush()
+                if self.file_handler.maxBytes and stream.tell() >= self.file_handler.maxBytes:
+                    self.file_handler.doRollover()
+        except Exception:
+            self.handleError(record)
+
+    def set_file(self, path: str | None, max_bytes: int = 0, backup_count: int = 0) -> None:
+        if self.file_handler is not None:
+            self.file_handler.close()
+            self.file_handler = None
+        if path:
+            self.file_handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+            )
+
+
+LOG_QUEUE: queue.SimpleQueue = queue.SimpleQueue()
+log_fanout_handler = LogFanoutHandler()
+log_listener = logging.handlers.QueueListener(LOG_QUEUE, log_fanout_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 
 def setup_logger(name: str = __name__, level: int = logging.INFO) -> logging.Logger:
-    formatter = logging.Formatter(
-        "%(asctime)s - [%(levelname)s] - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
     logger = logging.getLogger(name)
     logger.setLevel(level)
     if logger.hasHandlers():
         logger.handlers.clear()
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setFormatter(formatter)
-    logger.addHandler(stdout_handler)
-    log_buffer_handler = logging.StreamHandler(LogBufferIO())
-    log_buffer_handler.setFormatter(formatter)
-    logger.addHandler(log_buffer_handler)
+    logger.addHandler(LogQueueHandler(LOG_QUEUE))
     return logger
 
 
-def get_recent_logs() -> str:
-    return "\n".join(LOG_BUFFER)
+logger = setup_logger(__name__)
+_log_file_settings: tuple | None = None
+
+
+def configure_logging(config) -> None:
+    global _log_file_settings
+    LOG_BUFFER.resize(config.get("log_buffer_size", DEFAULT_LOG_BUFFER_SIZE))
+
+    log_file = config.get("log_file") or {}
+    settings = (log_file.get("path"), log_file.get("max_bytes", 10485760), log_file.get("backup_count", 5))
+    if settings == _log_file_settings:
+        return
+    # the handler lock keeps the listener thread from writing while the file is swapped
+    with log_fanout_handler.lock:
+        try:
+            log_fanout_handler.set_file(*settings)
+        except OSError as e:
+            log_fanout_handler.file_handler = None
+            logger.error(f"could not open log file '{settings[0]}': {e}")
+    _log_file_settings = settings
+
+
+def get_recent_logs(cursor: int = 0) -> tuple[list[str], int]:
+    return LOG_BUFFER.since(cursor)
 
 
 def get_config_path() -> str:
@@ -49,9 +161,69 @@ def get_config_path() -> str:
     return os.path.join(project_root, "config.yaml")
 
 
-def load_config() -> dict:
+def freeze_config(value):
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze_config(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_config(item) for item in value)
+    return value
+
+
+def thaw_config(value):
+    if isinstance(value, Mapping):
+        return {key: thaw_config(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw_config(item) for item in value]
+    return value
+
+
+def validate_config(config_data) -> list[str]:
+    from pydantic import ValidationError
+    from nutalert.models import AppConfig
+
+    try:
+        AppConfig.model_validate(config_data)
+    except ValidationError as e:
+        return [f"{'.'.join(str(part) for part in error['loc']) or 'config'}: {error['msg']}" for error in e.errors()]
+    return []
+
+
+_config_lock = threading.Lock()
+# (path, stamp, snapshot), replaced as a whole so readers never see a torn update
+_config_cache: tuple = (None, None, None)
+
+
+def _get_config_stamp(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _publish_config(path: str, stamp, config_data) -> Mapping:
+    global _config_cache
+    snapshot = freeze_config(config_data)
+    _config_cache = (path, stamp, snapshot)
+    return snapshot
+
+
+def _keep_last_valid_config(path: str, stamp) -> Mapping:
+    global _config_cache
+    cached_path, _, snapshot = _config_cache
+    if cached_path != path or snapshot is None:
+        snapshot = freeze_config({})
+        logging.getLogger(__name__).error(f"No valid config loaded yet, waiting for '{path}' to be fixed")
+    else:
+        logging.getLogger(__name__).warning(f"Keeping the previous config until '{path}' is fixed")
+    # the file is only read again once it changes
+    _config_cache = (path, stamp, snapshot)
+    return snapshot
+
+
+@traced("load_config")
+def load_config() -> Mapping:
     path = get_config_path()
-    if not os.path.exists(path):
+    try:
+        stamp = _get_config_stamp(path)
+    except FileNotFoundError:
         logging.getLogger(__name__).warning(f"Config file not found at '{path}'. Creating a default one.")
         default_config = {
             "nut_server": {"host": "127.0.0.1", "port": 3493, "timeout": 5},
@@ -60,20 +232,47 @@ def load_config() -> dict:
             "basic_alerts": {"battery_charge": {"enabled": False, "min": 20}},
         }
         save_config(default_config)
-        return default_config
+        return freeze_config(default_config)
+
+    cached_path, cached_stamp, snapshot = _config_cache
+    if cached_path == path and cached_stamp == stamp:
+        return snapshot
+
+    with _config_lock:
+        cached_path, cached_stamp, snapshot = _config_cache
+        if cached_path == path and cached_stamp == stamp:
+            return snapshot
+        try:
+            with open(path, "r") as f:
+                config_data = yaml.safe_load(f) or {}
+        except yaml.YAMLError as e:
+            logging.getLogger(__name__).error(f"Error parsing config file '{path}': {e}")
+            return _keep_last_valid_config(path, stamp)
+        errors = validate_config(config_data) if config_data else []
+        if errors:
+            for error in errors:
+                logging.getLogger(__name__).error(f"Invalid config in '{path}': {error}")
+            return _keep_last_valid_config(path, stamp)
+        logging.getLogger(__name__).info(f"Loaded config from '{path}'")
+        return _publish_config(path, stamp, config_data)
+
+
+def read_config_text() -> str:
+    # the file as written, an invalid config is not what load_config serves
     try:
-        with open(path, "r") as f:
-            return yaml.safe_load(f) or {}
-    except yaml.YAMLError as e:
-        logging.getLogger(__name__).error(f"Error parsing config file '{path}': {e}")
-        return {}
+        with open(get_config_path(), "r") as f:
+            return f.read()
+    except OSError:
+        return yaml.dump(thaw_config(load_config()), sort_keys=False, indent=2)
 
 
 def save_config(config_data: dict) -> str:
     path = get_config_path()
     try:
-        with open(path, "w") as f:
-            yaml.dump(config_data, f, sort_keys=False, indent=2)
+        with _config_lock:
+            with open(path, "w") as f:
+                yaml.dump(thaw_config(config_data), f, sort_keys=False, indent=2)
+            _publish_config(path, _get_config_stamp(path), config_data)
         return "✅ Configuration saved successfully!"
     except Exception as e:
         error_msg = f"Error saving configuration: {e}"
@@ -0,0 +1,62 @@
+import pytest
+
+from nutalert.alert import compile_formula, evaluate_formula, prepare_ups_env
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "battery_charge < 90 or ups_status != 'ol'",
+        "actual_runtime_minutes < (60 if ups_load <= 15 else (30 if ups_load >= 50 else 60 - (ups_load * 0.6)))",
+        "time_to_empty_minutes < 10 and charge_rate < 0",
+        "(battery_charge / 100.0) * (battery_voltage / input_voltage) * (actual_runtime_minutes / 60) < 0.5",
+        "ups_status.lower().startswith('ob') or ups_status.endswith('lb')",
+        "ups_load ** 2 > 100 and battery_charge ** -0.5 < 1",
+        "(battery_charge < 5) * 3 + ups_load % 7 > 1",
+    ],
+)
+def test_accepts_formulas(expression):
+    assert compile_formula(expression, "charge {battery_charge:.0f}%").error is None
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "__import__('os')",
+        "'{0.__class__.__mro__}'.format(ups_status)",
+        "ups_status.center(10**9) == ''",
+        "ups_status.__class__ == 1",
+        "ups_status.lower == 1",
+        "ups_status.startswith(prefix='ob')",
+        "ups_status * 10**8 == ''",
+        "'%999999999d' % 1 == ''",
+        "('a' or 'b') * 10**8 == ''",
+        "(ups_status or 'x') * 10**8 == ''",
+        "(ups_status and ups_status) * 5 == ''",
+        "(ups_status if ups_load else 1) * 3 == 1",
+        "9**9**9 > 1",
+        "(((9**99)**99)**99)**9 > 1",
+        "ups_load ** battery_charge > 1",
+        "[x for x in (1, 2)]",
+        "lambda: 1",
+        "unknown_variable > 1",
+    ],
+)
+def test_rejects_formulas(expression):
+    assert compile_formula(expression, "").error is not None
+
+
+@pytest.mark.parametrize("message", ["{ups_status.__class__}", "{ups_status[0]}", "{}", "{ups_load:{ups_status.x}}"])
+def test_rejects_message_lookups(message):
+    assert compile_formula("ups_load > 1", message).error is not None
+
+
+def test_evaluates_formula_and_message():
+    formula = compile_formula("ups_status.startswith('ob') and ups_load > 20", "on battery at {ups_load:.0f}% load")
+    envs = [
+        prepare_ups_env({"ups.status": "OB DISCHRG", "ups.load": 35}),
+        prepare_ups_env({"ups.status": "OL", "ups.load": 35}),
+    ]
+    (alerting, message), (ok, _) = evaluate_formula(formula, envs)
+    assert alerting and message == "on battery at 35% load"
+    assert not ok
@@ -0,0 +1,84 @@
+from nutalert.scheduler import PollScheduler
+
+CONFIG = {"check_interval": 15, "polling": {"fast_interval": 5, "slow_interval": 60, "stable_polls": 2, "jitter": 0}}
+SERVERS = [{"host": "a", "port": 3493, "timeout": 5}, {"host": "b", "port": 3493, "timeout": 5}]
+
+
+def snapshot(status="OL", charge=100, stale=False):
+    return {
+        "nut_values": {"ups.status": status, "battery.charge": charge},
+        "is_alerting": False,
+        "alert_rules": {},
+        "stale": stale,
+    }
+
+
+def test_everything_is_due_at_first():
+    assert PollScheduler().due(SERVERS, now=0) == SERVERS
+
+
+def test_deadlines_follow_check_interval():
+    scheduler = PollScheduler()
+    scheduler.update(SERVERS, {"ups@a:3493": snapshot(), "ups@b:3493": snapshot()}, CONFIG, now=0)
+    assert scheduler.time_until_next(now=0) == 15
+    assert scheduler.due(SERVERS, now=15) == SERVERS
+
+
+def test_early_wake_up_takes_the_next_server():
+    scheduler = PollScheduler()
+    scheduler.update(SERVERS[:1], {"ups@a:3493": snapshot()}, CONFIG, now=0)
+    scheduler.update(SERVERS[1:], {"ups@b:3493": snapshot()}, CONFIG, now=3)
+    assert scheduler.due(SERVERS, now=10) == SERVERS[:1]
+
+
+def test_on_battery_polls_at_fast_interval():
+    scheduler = PollScheduler()
+    scheduler.update(SERVERS[:1], {"ups@a:3493": snapshot(status="OB DISCHRG")}, CONFIG, now=0)
+    assert scheduler.time_until_next(now=0) == 5
+
+
+def test_stable_devices_slow_down_and_a_change_speeds_up():
+    scheduler = PollScheduler()
+    for now in (0, 15, 30):
+        scheduler.update(SERVERS[:1], {"ups@a:3493": snapshot()}, CONFIG, now=now)
+    assert scheduler.intervals["a:3493"] == 60
+    scheduler.update(SERVERS[:1], {"ups@a:3493": snapshot(charge=90)}, CONFIG, now=90)
+    assert scheduler.intervals["a:3493"] == 5
+
+
+def test_stale_devices_keep_the_regular_interval():
+    scheduler = PollScheduler()
+    scheduler.update(SERVERS[:1], {"ups@a:3493": snapshot(status="OB", stale=True)}, CONFIG, now=0)
+    assert scheduler.intervals["a:3493"] == 15
+
+
+def test_deadlines_stay_on_a_fixed_grid():
+    scheduler = PollScheduler()
+    scheduler.update(SERVERS[:1], {"ups@a:3493": snapshot()}, CONFIG, now=0)
+    # finishing the poll two seconds late does not push the next one back
+    scheduler.update(SERVERS[:1], {"ups@a:3493": snapshot()}, CONFIG, now=17)
+    assert scheduler.time_until_next(now=17) == 13
+
+
+def test_removed_servers_lose_their_deadline():
+    scheduler = PollScheduler()
+    scheduler.update(SERVERS, {"ups@a:3493": snapshot(), "ups@b:3493": snapshot()}, CONFIG, now=0)
+    scheduler.due(SERVERS[:1], now=1)
+    assert set(scheduler.deadlines) == {"a:3493"}
+
+
+def test_nothing_scheduled_waits_an_interval_instead_of_spinning():
+    scheduler = PollScheduler()
+    assert scheduler.time_until_next(now=0) == 15
+    scheduler.retry_later({"check_interval": 30}, now=0)
+    assert scheduler.time_until_next(now=0) == 30
+
+
+def test_retry_later_holds_back_overdue_deadlines():
+    scheduler = PollScheduler()
+    scheduler.update(SERVERS, {"ups@a:3493": snapshot(), "ups@b:3493": snapshot()}, CONFIG, now=0)
+    # the config broke, the old deadlines are already due but the retry wins
+    scheduler.retry_later({}, now=100)
+    assert scheduler.time_until_next(now=100) == 15
+    scheduler.update(SERVERS, {"ups@a:3493": snapshot(), "ups@b:3493": snapshot()}, CONFIG, now=115)
+    assert scheduler.retry_at is None
@@ -0,0 +1,100 @@
+from nutalert.tracker import AlertTracker, FIRING, RESOLVED, get_alert_policy
+
+
+def make_policy(**alert_policy):
+    config = {"alert_policy": alert_policy, "notifications": {"cooldown": 0}}
+    return get_alert_policy(config)
+
+
+def breach(message="load high"):
+    return {"ups@nut:3493": {"load": (True, message)}}
+
+
+def clear():
+    # rules that are neither breaching nor inside their hysteresis band are left out of the results
+    return {"ups@nut:3493": {}}
+
+
+def in_band():
+    return {"ups@nut:3493": {"load": (False, "load back under the limit")}}
+
+
+def test_fires_on_first_breach_with_defaults():
+    tracker = AlertTracker()
+    events = tracker.update(breach(), make_policy(), now=0)
+    assert events == [(FIRING, "ups@nut:3493", "load", "load high")]
+    assert tracker.get_states("ups@nut:3493") == {"load": FIRING}
+
+
+def test_fire_after_waits_for_consecutive_breaches():
+    tracker, policy = AlertTracker(), make_policy(fire_after=3)
+    assert tracker.update(breach(), policy, now=0) == []
+    assert tracker.update(breach(), policy, now=1) == []
+    assert tracker.update(breach(), policy, now=2) == [(FIRING, "ups@nut:3493", "load", "load high")]
+
+
+def test_pending_alert_is_dropped_when_the_value_recovers():
+    tracker, policy = AlertTracker(), make_policy(fire_after=2)
+    tracker.update(breach(), policy, now=0)
+    assert tracker.update(clear(), policy, now=1) == []
+    assert tracker.get_states("ups@nut:3493") == {}
+    # the count starts over after a recovery
+    assert tracker.update(breach(), policy, now=2) == []
+
+
+def test_resolve_after_and_notify_resolved():
+    tracker, policy = AlertTracker(), make_policy(resolve_after=2, notify_resolved=True)
+    tracker.update(breach(), policy, now=0)
+    assert tracker.update(clear(), policy, now=1) == []
+    assert tracker.update(clear(), policy, now=2) == [(RESOLVED, "ups@nut:3493", "load", "load high")]
+    assert tracker.update(clear(), policy, now=3) == []
+    assert tracker.get_states("ups@nut:3493") == {}
+
+
+def test_resolved_events_are_not_sent_by_default():
+    tracker, policy = AlertTracker(), make_policy()
+    tracker.update(breach(), policy, now=0)
+    assert tracker.update(clear(), policy, now=1) == []
+    assert tracker.get_states("ups@nut:3493") == {"load": RESOLVED}
+    tracker.update(clear(), policy, now=2)
+    assert tracker.get_states("ups@nut:3493") == {}
+
+
+def test_firing_alert_is_not_repeated_without_cooldown():
+    tracker, policy = AlertTracker(), make_policy()
+    tracker.update(breach(), policy, now=0)
+    assert tracker.update(breach(), policy, now=100) == []
+
+
+def test_firing_alert_repeats_after_cooldown():
+    tracker = AlertTracker()
+    policy = get_alert_policy({"notifications": {"cooldown": 60}})
+    tracker.update(breach(), policy, now=0)
+    assert tracker.update(breach(), policy, now=30) == []
+    assert tracker.update(breach("load higher"), policy, now=61) == [(FIRING, "ups@nut:3493", "load", "load higher")]
+
+
+def test_hysteresis_band_holds_a_firing_alert():
+    tracker, policy = AlertTracker(), make_policy(notify_resolved=True)
+    tracker.update(breach(), policy, now=0)
+    assert tracker.update(in_band(), policy, now=1) == []
+    assert tracker.get_states("ups@nut:3493") == {"load": FIRING}
+    assert tracker.update(clear(), policy, now=2) == [(RESOLVED, "ups@nut:3493", "load", "load high")]
+
+
+def test_hysteresis_band_does_not_start_an_alert():
+    tracker, policy = AlertTracker(), make_policy()
+    assert tracker.update(in_band(), policy, now=0) == []
+    assert tracker.get_states("ups@nut:3493") == {}
+
+
+def test_coalesce_window_sends_latest_event_per_alert():
+    tracker, policy = AlertTracker(), make_policy(coalesce_window=30, notify_resolved=True)
+    assert tracker.update(breach(), policy, now=0) == []
+    other = {"ups@nut:3493": {"load": (True, "load high"), "battery_charge": (True, "charge low")}}
+    assert tracker.update(other, policy, now=10) == []
+    events = tracker.update(other, policy, now=31)
+    assert sorted(events) == [
+        (FIRING, "ups@nut:3493", "battery_charge", "charge low"),
+        (FIRING, "ups@nut:3493", "load", "load high"),
+    ]